@@ -0,0 +1,60 @@
+"""Measures the memory retained by the AST of a large synthetic DGML project.
+
+Usage: python benchmarks/memory.py [--sections N] [--files N]
+"""
+
+import argparse
+import gc
+import sys
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dgml.parser import ErrorContext, parse_dgml, get_dgml_parser, SayNode, ChoiceNode
+from synth import generate_dgml
+
+
+def count_dialog_lines(sections) -> int:
+    count = 0
+    for section in sections:
+        for node in section.nodes:
+            if isinstance(node, SayNode):
+                count += 1
+            elif isinstance(node, ChoiceNode):
+                count += len(node.options)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sections", type=int, default=300)
+    parser.add_argument("--files", type=int, default=4)
+    args = parser.parse_args()
+
+    sources = [
+        generate_dgml(args.sections, seed=i, prefix=f"file{i}")
+        for i in range(args.files)
+    ]
+    get_dgml_parser()
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    project = [
+        parse_dgml(ErrorContext([]), f"file{i}.dgml", source)
+        for i, source in enumerate(sources)
+    ]
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    num_lines = sum(count_dialog_lines(sections) for sections in project)
+    num_nodes = sum(len(s.nodes) for sections in project for s in sections)
+    print(f"{num_nodes} nodes, {num_lines} dialogue lines")
+    print(f"retained AST memory: {retained / 1024 / 1024:.1f} MiB")
+    print(f"bytes per dialogue line: {retained / num_lines:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Measures parse_dgml time and allocations on a large synthetic DGML file.
+
+Usage: python benchmarks/parse.py [--sections N] [--runs N]
+"""
+
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dgml.parser import ErrorContext, parse_dgml, get_dgml_parser
+from synth import generate_dgml
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sections", type=int, default=300)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    source = generate_dgml(args.sections)
+    num_lines = source.count("\n")
+    get_dgml_parser()
+
+    times = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        parse_dgml(ErrorContext([]), "synth.dgml", source)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    parse_dgml(ErrorContext([]), "synth.dgml", source)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{num_lines} lines, {len(source)} bytes")
+    print(f"parse time: min {min(times) * 1000:.1f} ms")
+    print(f"peak traced memory: {peak / 1024 / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
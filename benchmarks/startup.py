@@ -0,0 +1,55 @@
+"""Measures the wall time of one-file `dgml lint` runs (like editor hooks do them),
+with and without the cached parser tables.
+
+Usage: python benchmarks/startup.py [-n RUNS]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+EXAMPLE_DIR = REPO_DIR / "examples" / "quest"
+
+
+def run_lint(env) -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-m", "dgml", "lint", "-q", "-c", "quest.yaml", "quest.dgml"],
+        cwd=EXAMPLE_DIR,
+        env=env,
+        check=True,
+    )
+    return time.perf_counter() - start
+
+
+def bench(name, env, runs):
+    times = sorted(run_lint(env) for _ in range(runs))
+    print(
+        f"{name:<16} min {times[0] * 1000:7.1f} ms  median {times[len(times) // 2] * 1000:7.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = str(REPO_DIR) + os.pathsep + env.get("PYTHONPATH", "")
+
+    env["DGML_CACHE_DIR"] = ""
+    bench("no table cache", env, args.runs)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env["DGML_CACHE_DIR"] = cache_dir
+        run_lint(env)  # populate the cache
+        bench("table cache", env, args.runs)
+
+
+if __name__ == "__main__":
+    main()
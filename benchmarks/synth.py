@@ -0,0 +1,47 @@
+"""Generates synthetic DGML sources for the benchmarks.
+
+Usage: python benchmarks/synth.py NUM_SECTIONS > synth.dgml
+"""
+
+import random
+import sys
+
+
+def generate_dgml(num_sections, seed=0, prefix="section"):
+    r = random.Random(seed)
+    out = []
+    for s in range(num_sections):
+        out.append(f"[{prefix}_{s}]\n")
+        out.append("IF |quest_completed| @done\n")
+        out.append(
+            "IF |quest_accepted and inventory.glow_berries >= 5| @menu @intro\n\n"
+        )
+        out.append(f"@intro   #scene:dock #mood:cheerful\n")
+        for i in range(10):
+            sp = r.choice(["player", "alien"])
+            kind = r.random()
+            if kind < 0.6:
+                t = f"Plain line number {i} of section {s}, nothing special here."
+            elif kind < 0.8:
+                t = f"Hello, {{player}}. Take [color:magenta]{i} berries[/color] [bold]now[/bold]!"
+            else:
+                t = f"Escapes [[like this]] and {{{{ this }}}} in line {i}."
+            lid = f" %{prefix}_{s}_{i}" if r.random() < 0.5 else ""
+            out.append(f'{sp}: "{t}"{lid}\n')
+        out.append("@menu\nCHOICE\n")
+        out.append('  "What is this place?"  @about\n')
+        out.append('  |not quest_accepted| "Sure, what do you need?"  @offer\n')
+        out.append('  |inventory.glow_berries >= 5| "Here they are."  @done\n')
+        out.append('  "I gotta go"  @end\n\n')
+        out.append(
+            '@about  #mood:informative\nalien: "[bold]Polestar[/bold] station." -> @menu\n'
+        )
+        out.append(
+            '@offer\nalien: "Fetch?"\nRUN |quest_accepted = true|\nRUN |credits = credits + 50|\nRAND @about @menu\n'
+        )
+        out.append('@done ; comment\nalien: "Thanks again."\nGOTO @end\n\n')
+    return "".join(out)
+
+
+if __name__ == "__main__":
+    sys.stdout.write(generate_dgml(int(sys.argv[1])))
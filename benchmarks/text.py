@@ -0,0 +1,61 @@
+"""Micro-benchmark for parse_text over a corpus of dialogue lines.
+
+Usage: python benchmarks/text.py [--lines N] [--runs N]
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dgml.parser import parse_text
+
+WORDS = "the a station berries crate deck you we old captain ship fuel credits".split()
+
+# Roughly the distribution of a real project: mostly plain text
+LINE_KINDS = [
+    (0.7, lambda r, words: words),
+    (0.1, lambda r, words: f"Hello, {{player}}. {words}"),
+    (0.1, lambda r, words: f"{words} [color:magenta]{words}[/color]!"),
+    (0.05, lambda r, words: f"[bold]{words}[/bold] {{credits}} credits, {{player}}."),
+    (0.05, lambda r, words: f"{words} [[not markup]] and {{{{braces}}}}"),
+]
+
+
+def generate_line(r: random.Random) -> str:
+    words = " ".join(r.choice(WORDS) for _ in range(r.randint(4, 20)))
+    x = r.random()
+    for p, make in LINE_KINDS:
+        if x < p:
+            return make(r, words)
+        x -= p
+    return words
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=50000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    r = random.Random(0)
+    corpus = [generate_line(r) for _ in range(args.lines)]
+
+    plain = [line for line in corpus if "[" not in line and "{" not in line]
+    markup = [line for line in corpus if "[" in line or "{" in line]
+    print(f"{len(corpus)} lines, {sum(len(line) for line in corpus)} bytes")
+    for name, lines in [("all", corpus), ("plain", plain), ("markup", markup)]:
+        times = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            for line in lines:
+                parse_text(line)
+            times.append(time.perf_counter() - start)
+        print(f"{name:<7} {min(times) / len(lines) * 1e9:6.0f} ns/line")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import hashlib
+import json
+import os
+import pickle
+from dataclasses import dataclass
+from pathlib import Path
+
+from . import parser
+
+# Bump this if the pickled representation changes in a way that is not covered
+# by the hash of the parser sources (e.g. changes to pickle protocol handling).
+CACHE_FORMAT_VERSION = 1
+
+# Everything that influences the output of parse_dgml
+PARSER_FILES = ["parser.py", "dgml.lark"]
+# Everything that influences the results of lint, given the parsed sections
+LINT_FILES = ["lint.py", "config.py"]
+# Everything that influences the compiled sections, given the lint results
+COMPILE_FILES = ["compile.py", "dgmlb_writer.py"]
+
+
+def hash_source(source: str) -> str:
+    return hashlib.md5(source.encode("utf-8")).hexdigest()
+
+
+def hash_file(source_path: str) -> str:
+    """Same as hash_source for the contents of the file, without reading it at once."""
+    h = hashlib.md5()
+    with open(source_path) as f:
+        for line in f:
+            h.update(line.encode("utf-8"))
+    return h.hexdigest()
+
+
+def hash_config(config) -> str:
+    return hash_source(json.dumps(config, sort_keys=True, default=str))
+
+
+def hash_package_files(names: list[str]) -> str:
+    h = hashlib.md5(f"dgml-cache-{CACHE_FORMAT_VERSION}".encode("utf-8"))
+    pkg_dir = Path(__file__).parent
+    for name in names:
+        h.update((pkg_dir / name).read_bytes())
+    return h.hexdigest()
+
+
+def get_parser_hash() -> str:
+    if not hasattr(get_parser_hash, "_hash"):
+        setattr(get_parser_hash, "_hash", hash_package_files(PARSER_FILES))
+    return getattr(get_parser_hash, "_hash")
+
+
+def get_lint_hash() -> str:
+    if not hasattr(get_lint_hash, "_hash"):
+        setattr(get_lint_hash, "_hash", hash_package_files(PARSER_FILES + LINT_FILES))
+    return getattr(get_lint_hash, "_hash")
+
+
+def get_compile_hash() -> str:
+    if not hasattr(get_compile_hash, "_hash"):
+        names = PARSER_FILES + LINT_FILES + COMPILE_FILES
+        setattr(get_compile_hash, "_hash", hash_package_files(names))
+    return getattr(get_compile_hash, "_hash")
+
+
+def load_pickle(path: Path):
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # Corrupted or incompatible cache entries are simply computed again
+        return None
+
+
+def store_pickle(path: Path, obj):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file first, so concurrent builds never see partial files
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+class ParseCache:
+    """Stores the processed sections of a DGML file on disk, keyed by the hash of its
+    source and the hash of the parser (grammar and processing code).
+    """
+
+    def __init__(self, cache_dir: str):
+        self.dir = Path(cache_dir) / "parse"
+
+    def get_path(self, source_hash: str) -> Path:
+        key = hashlib.md5(f"{get_parser_hash()}:{source_hash}".encode("utf-8"))
+        return self.dir / f"{key.hexdigest()}.pickle"
+
+    def load(self, source_hash: str) -> list[parser.Section] | None:
+        return load_pickle(self.get_path(source_hash))
+
+    def store(self, source_hash: str, sections: list[parser.Section]):
+        store_pickle(self.get_path(source_hash), sections)
+
+
+def parse_dgml_cached(
+    ctx: parser.ErrorContext,
+    cache: ParseCache | None,
+    source_path: str,
+    source: str,
+    source_hash: str | None = None,
+):
+    if cache is None:
+        return parser.parse_dgml(ctx, source_path, source)
+
+    if source_hash is None:
+        source_hash = hash_source(source)
+
+    sections = cache.load(source_hash)
+    if sections is not None:
+        return sections
+
+    sections = parser.parse_dgml(ctx, source_path, source)
+    # Files with syntax errors are not cached, so the error is reported every time
+    if sections is not None:
+        cache.store(source_hash, sections)
+    return sections
+
+
+def iter_dgml_sections_cached(
+    ctx: parser.ErrorContext,
+    cache: ParseCache | None,
+    source_path: str,
+    source_hash: str,
+    positions: bool = True,
+):
+    if cache is None:
+        yield from parser.iter_dgml_sections(ctx, source_path, positions)
+        return
+
+    # Cached sections always have positions, so the same entries can be used by lint
+
+    sections = cache.load(source_hash)
+    if sections is not None:
+        yield from sections
+        return
+
+    # The sections have to be kept for the cache entry, but are still passed on as
+    # soon as they are parsed
+    parse_ctx = parser.ErrorContext([])
+    sections = []
+    for section in parser.iter_dgml_sections(parse_ctx, source_path):
+        sections.append(section)
+        yield section
+    ctx.messages.extend(parse_ctx.messages)
+    if len(parse_ctx.messages) == 0:
+        cache.store(source_hash, sections)
+
+
+def get_parse_cache(args) -> ParseCache | None:
+    if getattr(args, "cache_dir", None):
+        return ParseCache(args.cache_dir)
+    return None
+
+
+@dataclass
+class LintResult:
+    """The lint result of a single file: the messages of the rules that only look at
+    one section and the facts the cross-file rules need (see Linter.get_facts).
+    """
+
+    messages: list[parser.Message]
+    facts: dict
+
+
+class LintCache:
+    """Stores the lint results of single files on disk, keyed by the path and hash
+    of the file, the hash of the config and the hash of the lint code.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.dir = Path(cache_dir) / "lint"
+
+    def get_path(self, source_path: str, source_hash: str, config_hash: str) -> Path:
+        key = f"{get_lint_hash()}:{config_hash}:{source_path}:{source_hash}"
+        return self.dir / f"{hashlib.md5(key.encode('utf-8')).hexdigest()}.pickle"
+
+    def load(
+        self, source_path: str, source_hash: str, config_hash: str
+    ) -> LintResult | None:
+        return load_pickle(self.get_path(source_path, source_hash, config_hash))
+
+    def store(
+        self, source_path: str, source_hash: str, config_hash: str, result: LintResult
+    ):
+        store_pickle(self.get_path(source_path, source_hash, config_hash), result)
+
+
+class CompileCache:
+    """Stores the compiled sections of single files (see compile.compile_file), keyed
+    by the path and hash of the file, the hash of the config, the options of the
+    compiler (such as the encoding of the sections) and the hash of the compiler.
+    Which meta data a file uses is only known after it was compiled, so the hash of
+    that part of the meta data is stored with every entry and compared by the caller.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.dir = Path(cache_dir) / "compile"
+
+    def get_path(
+        self, source_path: str, source_hash: str, config_hash: str, options: str
+    ) -> Path:
+        key = (
+            f"{get_compile_hash()}:{config_hash}:{options}:{source_path}:{source_hash}"
+        )
+        return self.dir / f"{hashlib.md5(key.encode('utf-8')).hexdigest()}.pickle"
+
+    def load(self, source_path: str, source_hash: str, config_hash: str, options: str):
+        """Returns (meta hash, compiled file) or None."""
+        path = self.get_path(source_path, source_hash, config_hash, options)
+        return load_pickle(path)
+
+    def store(
+        self,
+        source_path: str,
+        source_hash: str,
+        config_hash: str,
+        options: str,
+        meta_hash: str,
+        compiled,
+    ):
+        path = self.get_path(source_path, source_hash, config_hash, options)
+        store_pickle(path, (meta_hash, compiled))
@@ -6,7 +6,9 @@ from .compile import main as main_compile
 from .play import main as main_play
 from .util import main_ast as main_util_ast
 from .meta import main_set as main_meta_set, main_get as main_meta_get
+from .explore import main as main_explore
 from .lint import main as main_lint
+from .lsp import main as main_lsp
 
 
 def add_compile_parser(subparsers):
@@ -20,6 +22,37 @@ def add_compile_parser(subparsers):
     parser_compile.add_argument(
         "--binary", "-b", help="Output binary dgmlb file instead", action="store_true"
     )
+    parser_compile.add_argument(
+        "--indexed",
+        action="store_true",
+        help="Output the indexed JSON format (with string and tag set tables)",
+    )
+    parser_compile.add_argument(
+        "--compact",
+        action="store_true",
+        help="Output JSON without indentation and whitespace",
+    )
+    parser_compile.add_argument(
+        "--optimize",
+        "-O",
+        action="store_true",
+        help="Fold constant conditions, skip GOTO nodes and remove unreachable nodes",
+    )
+    parser_compile.add_argument(
+        "--bytecode",
+        action="store_true",
+        help="Include the stack bytecode of every expression in the JSON output",
+    )
+    parser_compile.add_argument(
+        "--cache-dir", help="Directory to cache parsed source files in"
+    )
+    parser_compile.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Number of processes to parse and lint files in (0 for one per CPU)",
+    )
     parser_compile.add_argument("input", nargs="+", help="DGML files")
 
 
@@ -42,7 +75,80 @@ def add_lint_parser(subparsers):
         action="store_true",
         help="Don't output anything if there are no errors or warnings",
     )
-    parser_lint.add_argument("input", nargs="+", help="DGML files")
+    parser_lint.add_argument(
+        "--cache-dir", help="Directory to cache parsed source files in"
+    )
+    parser_lint.add_argument(
+        "--timings", action="store_true", help="Print the time spent in each rule"
+    )
+    parser_lint.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Number of processes to parse and lint files in (0 for one per CPU)",
+    )
+    parser_lint.add_argument(
+        "--glob",
+        default="**/*.dgml",
+        help="Files to lint in directories given as input (default: **/*.dgml)",
+    )
+    parser_lint.add_argument(
+        "--debounce",
+        type=int,
+        default=1600,
+        help="In watch mode, the longest time in ms to collect changes before linting",
+    )
+    parser_lint.add_argument("input", nargs="+", help="DGML files or directories")
+
+
+def add_lsp_parser(subparsers):
+    parser_lsp = subparsers.add_parser(
+        "lsp", help="Run a language server on stdin and stdout"
+    )
+    parser_lsp.set_defaults(func=main_lsp)
+    parser_lsp.add_argument("--config", "-c")
+    parser_lsp.add_argument(
+        "--glob",
+        default="**/*.dgml",
+        help="Files of the workspace to lint (default: **/*.dgml)",
+    )
+
+
+def add_explore_parser(subparsers):
+    parser_explore = subparsers.add_parser(
+        "explore", help="Find dead ends and branches that are never taken"
+    )
+    parser_explore.set_defaults(func=main_explore)
+    parser_explore.add_argument("--config", "-c")
+    parser_explore.add_argument(
+        "--env",
+        "-e",
+        action="append",
+        default=[],
+        help="JSON file with an initial environment (or a list of them)",
+    )
+    parser_explore.add_argument(
+        "--section", "-s", action="append", help="Only explore these sections"
+    )
+    parser_explore.add_argument(
+        "--max-states",
+        type=int,
+        default=100000,
+        help="Maximum number of states to explore per section",
+    )
+    parser_explore.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print the number of explored states of each section",
+    )
+    parser_explore.add_argument(
+        "--quiet",
+        "-q",
+        action="store_true",
+        help="Don't output anything if no problems were found",
+    )
+    parser_explore.add_argument("input", nargs="+", help="DGML files")
 
 
 def add_meta_parser(subparsers):
@@ -145,6 +251,8 @@ def main():
 
     add_compile_parser(subparsers)
     add_lint_parser(subparsers)
+    add_lsp_parser(subparsers)
+    add_explore_parser(subparsers)
     add_meta_parser(subparsers)
     add_localize_parser(subparsers)
     add_play_parser(subparsers)
@@ -1,22 +1,32 @@
+import functools
 import json
 import hashlib
+import operator
+import shutil
 import sys
+import tempfile
 from dataclasses import dataclass
 
 import yaml
 
 from . import parser
-from .config import load_config
-from .lint import lint
-from .dgmlb_writer import write_binary
+from .cache import (
+    CompileCache,
+    ParseCache,
+    get_parse_cache,
+    hash_config,
+    hash_file,
+    iter_dgml_sections_cached,
+)
+from .config import Environment, load_config
+from .lint import Linter, map_files
+from .dgmlb_writer import lower_expr, write_binary
 
 
 @dataclass
 class Source:
     path: str
-    source: str
     source_hash: str
-    sections: list
 
 
 def expr_to_json(expr):
@@ -31,13 +41,17 @@ def expr_to_json(expr):
     elif isinstance(expr, parser.ExprIdent):
         return {"type": f"variable", "name": expr.name}
     elif isinstance(expr, parser.ExprLiteral):
-        return {"type": f"literal_{type(expr.value).__name__}", "value": expr.value}
+        return literal_to_json(expr.value)
     elif isinstance(expr, parser.ExprAssign):
         return {"type": "assign", "name": expr.name, "value": expr_to_json(expr.value)}
     else:
         raise AssertionError("Invalid expr node")
 
 
+def literal_to_json(value):
+    return {"type": f"literal_{type(value).__name__}", "value": value}
+
+
 def text_to_json(text: list) -> list:
     ret = []
     tag_stack = []
@@ -52,9 +66,12 @@ def text_to_json(text: list) -> list:
             tag_stack.append((frag.name, frag.parameter))
             current_tags = {name: value for (name, value) in tag_stack}
         elif isinstance(frag, parser.TagClose):
-            # should have been checked by lint
-            assert tag_stack[-1][0] == frag.name
-            tag_stack.pop()
+            # Sections with mis-nested markup are reported by lint and not compiled,
+            # unless the rule is disabled, then the innermost tag of the name is closed
+            for i in range(len(tag_stack) - 1, -1, -1):
+                if tag_stack[i][0] == frag.name:
+                    del tag_stack[i]
+                    break
             current_tags = {name: value for (name, value) in tag_stack}
         else:
             raise AssertionError("Invalid text fragment")
@@ -71,14 +88,580 @@ def diag_line_to_json(section_meta, line):
     return jline
 
 
+# Keys of compiled nodes that hold a single node id
+DEST_KEYS = ("next", "dest", "true_dest", "false_dest")
+INTERNAL_NODE_TYPES = ("rand", "goto", "if", "run")
+
+
 def make_node(node, type, **kwargs):
-    r = {"tags": node.meta.tags, "type": type}
+    r = {"tags": list(node.meta.tags), "type": type}
     for k, v in kwargs.items():
         if v is not None:
             r[k] = v
     return r
 
 
+def get_jnode_dests(jnode: dict) -> list[str]:
+    """Returns the node ids a compiled node can continue at."""
+    dests = [jnode[key] for key in DEST_KEYS if key in jnode]
+    dests.extend(jnode.get("nodes", ()))
+    dests.extend(jopt["dest"] for jopt in jnode.get("options", ()))
+    return dests
+
+
+def is_internal_loop_free(nodes: dict) -> bool:
+    """Whether the compiled nodes have no cycle of internal nodes (all but SAY and
+    CHOICE), so runtimes don't need to limit the steps per advance. This is checked
+    on the compiled nodes rather than taken from lint, as they are what the runtime
+    executes (e.g. of nodes with duplicate ids, only the first one is compiled).
+    """
+    # node id -> True while it is on the current path, False when it is done
+    on_path = {}
+    for root, jroot in nodes.items():
+        if jroot["type"] not in INTERNAL_NODE_TYPES or root in on_path:
+            continue
+        on_path[root] = True
+        work = [(root, iter(get_jnode_dests(jroot)))]
+        while work:
+            node_id, dests = work[-1]
+            for dest in dests:
+                jdest = nodes.get(dest)
+                if jdest is None or jdest["type"] not in INTERNAL_NODE_TYPES:
+                    continue
+                if on_path.get(dest):
+                    return False
+                if dest not in on_path:
+                    on_path[dest] = True
+                    work.append((dest, iter(get_jnode_dests(jdest))))
+                    break
+            else:
+                on_path[node_id] = False
+                work.pop()
+    return True
+
+
+def compile_section(path, section, section_meta, speaker_ids):
+    nodes = {}
+    for i, node in enumerate(section.nodes):
+        if i == len(section.nodes) - 1:
+            next_node = "end"
+        else:
+            next_node = section.nodes[i + 1].meta.node_id
+
+        # Duplicate node ids are reported by lint
+        if node.meta.node_id in nodes:
+            continue
+
+        if isinstance(node, parser.RandNode):
+            nodes[node.meta.node_id] = make_node(node, "rand", nodes=node.nodes)
+        elif isinstance(node, parser.GotoNode):
+            nodes[node.meta.node_id] = make_node(node, "goto", dest=node.dest)
+        elif isinstance(node, parser.ChoiceNode):
+            opts = []
+            for opt in node.options:
+                opts.append(
+                    {
+                        "line": diag_line_to_json(section_meta, opt.line),
+                        "dest": opt.dest,
+                    }
+                )
+                if opt.cond:
+                    opts[-1]["cond"] = expr_to_json(opt.cond.ast)
+            nodes[node.meta.node_id] = make_node(node, "choice", options=opts)
+        elif isinstance(node, parser.IfNode):
+            false_dest = node.false_dest if node.false_dest is not None else next_node
+            nodes[node.meta.node_id] = make_node(
+                node,
+                "if",
+                cond=expr_to_json(node.cond.ast),
+                true_dest=node.true_dest,
+                false_dest=false_dest,
+            )
+
+        elif isinstance(node, parser.RunNode):
+            nodes[node.meta.node_id] = make_node(
+                node, "run", code=expr_to_json(node.code.ast), next=next_node
+            )
+
+        elif isinstance(node, parser.SayNode):
+            speaker_ids.add(node.speaker_id)
+            say_next_node = node.next_node if node.next_node is not None else next_node
+            nodes[node.meta.node_id] = make_node(
+                node,
+                "say",
+                speaker_id=node.speaker_id,
+                line=diag_line_to_json(section_meta, node.line),
+                next=say_next_node,
+            )
+
+        else:
+            sys.exit(f"Unknown node type: {type(node).__name__}")
+
+    jsection = {
+        "source_file": path,
+        "nodes": nodes,
+    }
+    if len(section.nodes) > 0:
+        jsection["start_node"] = section.nodes[0].meta.node_id
+    # Runtimes only need to limit the steps per advance if there are loops
+    jsection["internal_loop_free"] = is_internal_loop_free(nodes)
+    return jsection
+
+
+FOLD_BINARY_OPS = {
+    "binary_add": operator.add,
+    "binary_sub": operator.sub,
+    "binary_mul": operator.mul,
+    "binary_lt": operator.lt,
+    "binary_le": operator.le,
+    "binary_eq": operator.eq,
+    "binary_ne": operator.ne,
+    "binary_gt": operator.gt,
+    "binary_ge": operator.ge,
+}
+# Literal types that are folded. Float arithmetic is left to the runtime, as its
+# precision depends on the target (the binary format uses single precision).
+FOLD_LITERAL_TYPES = ("literal_bool", "literal_int", "literal_str")
+# Range of the integers of the binary format
+INT_MIN = -(2**31)
+INT_MAX = 2**31 - 1
+
+
+def is_literal(jexpr) -> bool:
+    return jexpr["type"] in FOLD_LITERAL_TYPES
+
+
+def fold_expr(jexpr: dict) -> dict:
+    """Replaces the subexpressions of a compiled expression that only depend on
+    literals by their value. The expressions have been type checked by lint, so this
+    only has to agree with the runtime on valid expressions.
+    """
+    t = jexpr["type"]
+    if t == "assign":
+        return {**jexpr, "value": fold_expr(jexpr["value"])}
+    elif t == "unary_not":
+        rhs = fold_expr(jexpr["rhs"])
+        if is_literal(rhs):
+            return literal_to_json(not rhs["value"])
+        return {**jexpr, "rhs": rhs}
+    elif t in ("binary_and", "binary_or"):
+        lhs = fold_expr(jexpr["lhs"])
+        rhs = fold_expr(jexpr["rhs"])
+        # Same short-circuit semantics as the runtime, so the value of rhs does not
+        # have to be known
+        if is_literal(lhs):
+            if t == "binary_and":
+                return rhs if lhs["value"] else lhs
+            return lhs if lhs["value"] else rhs
+        return {**jexpr, "lhs": lhs, "rhs": rhs}
+    elif t.startswith("binary_"):
+        lhs = fold_expr(jexpr["lhs"])
+        rhs = fold_expr(jexpr["rhs"])
+        if t in FOLD_BINARY_OPS and is_literal(lhs) and is_literal(rhs):
+            try:
+                value = FOLD_BINARY_OPS[t](lhs["value"], rhs["value"])
+            except TypeError:
+                value = None
+            if isinstance(value, (bool, str)) or (
+                isinstance(value, int) and INT_MIN <= value <= INT_MAX
+            ):
+                return literal_to_json(value)
+        return {**jexpr, "lhs": lhs, "rhs": rhs}
+    return jexpr
+
+
+def optimize_section(jsection: dict, section: parser.Section):
+    """Optimizes a compiled section in place, so runtimes take fewer steps and the
+    output gets smaller: constant expressions are folded, IF nodes with a constant
+    condition become GOTO nodes, references to GOTO nodes are replaced by their
+    destination and nodes that can no longer be reached are removed.
+
+    Node ids given in the source can be used by the game (e.g. to start the dialogue
+    there), as can the line ids, so the nodes with one of them are always kept.
+    """
+    nodes = jsection["nodes"]
+    for node_id, jnode in nodes.items():
+        if jnode["type"] == "run":
+            jnode["code"] = fold_expr(jnode["code"])
+        elif jnode["type"] == "choice":
+            for jopt in jnode["options"]:
+                if "cond" in jopt:
+                    jopt["cond"] = fold_expr(jopt["cond"])
+                    if is_literal(jopt["cond"]) and jopt["cond"]["value"]:
+                        del jopt["cond"]
+        elif jnode["type"] == "if":
+            cond = fold_expr(jnode["cond"])
+            if is_literal(cond):
+                dest = jnode["true_dest"] if cond["value"] else jnode["false_dest"]
+                nodes[node_id] = {"tags": jnode["tags"], "type": "goto", "dest": dest}
+            else:
+                jnode["cond"] = cond
+
+    def resolve(node_id):
+        # Loops of GOTO nodes are left alone, the runtime reports them
+        seen = set()
+        while node_id not in seen:
+            jnode = nodes.get(node_id)
+            if jnode is None or jnode["type"] != "goto":
+                break
+            seen.add(node_id)
+            node_id = jnode["dest"]
+        return node_id
+
+    for jnode in nodes.values():
+        for key in DEST_KEYS:
+            if key in jnode:
+                jnode[key] = resolve(jnode[key])
+        if "nodes" in jnode:
+            jnode["nodes"] = [resolve(node_id) for node_id in jnode["nodes"]]
+        for jopt in jnode.get("options", ()):
+            jopt["dest"] = resolve(jopt["dest"])
+
+    if "start_node" not in jsection:
+        return
+    # The start node must stay a node of the section (runtimes and the binary format
+    # can't start at the end), so a section that ends right away keeps its GOTO
+    start_node = resolve(jsection["start_node"])
+    if start_node in nodes:
+        jsection["start_node"] = start_node
+    roots = [jsection["start_node"]]
+    for node in section.nodes:
+        if not node.meta.generated:
+            roots.append(node.meta.node_id)
+    for node_id, jnode in nodes.items():
+        lines = [jopt["line"] for jopt in jnode.get("options", ())]
+        if "line" in jnode:
+            lines.append(jnode["line"])
+        if any(line["line_id"] is not None for line in lines):
+            roots.append(node_id)
+
+    reachable = set()
+    stack = roots
+    while stack:
+        node_id = stack.pop()
+        if node_id in reachable or node_id not in nodes:
+            continue
+        reachable.add(node_id)
+        stack.extend(get_jnode_dests(nodes[node_id]))
+
+    for node_id in list(nodes):
+        if node_id not in reachable:
+            del nodes[node_id]
+    # Folded conditions can remove loops
+    jsection["internal_loop_free"] = is_internal_loop_free(nodes)
+
+
+def expr_to_bytecode(jexpr: dict) -> list:
+    """Lowers a compiled expression to the stack bytecode of the binary format, as a
+    flat list of ops and their operands (see docs/engine_integration.md).
+    """
+    code = []
+    for op, operand in lower_expr(jexpr, short_circuit=True):
+        code += (op, operand)
+    return code
+
+
+def add_bytecode(jsection: dict):
+    """Adds the bytecode of every expression of a compiled section next to it."""
+    for jnode in jsection["nodes"].values():
+        if jnode["type"] == "if":
+            jnode["bytecode"] = expr_to_bytecode(jnode["cond"])
+        elif jnode["type"] == "run":
+            jnode["bytecode"] = expr_to_bytecode(jnode["code"])
+        elif jnode["type"] == "choice":
+            for jopt in jnode["options"]:
+                if "cond" in jopt:
+                    jopt["bytecode"] = expr_to_bytecode(jopt["cond"])
+
+
+def lint_with_positions(config, env, cache, files, fast_linter, paths):
+    """Lints the files in paths again, parsed with positions this time, to get the
+    locations of the messages found in a build without positions. The other files are
+    not parsed again, only their facts for the cross-file checks are reused.
+    """
+    ctx = parser.ErrorContext([])
+    linter = Linter(ctx, config, env=env)
+    for path, src_hash in files:
+        if path in paths:
+            # Syntax errors have already been reported
+            parse_ctx = parser.ErrorContext([])
+            for section in iter_dgml_sections_cached(parse_ctx, cache, path, src_hash):
+                linter.lint_section(path, section)
+        else:
+            linter.add_facts(path, fast_linter.get_facts(path))
+    linter.finish()
+    return ctx
+
+
+@dataclass
+class CompiledFile:
+    """The result of compile_file. Files with syntax errors are still linted, but
+    their sections are left out by main.
+    """
+
+    source_hash: str
+    parse_messages: list[parser.Message]
+    lint_messages: list[parser.Message]
+    facts: dict
+    # section name -> (compiled section, line ids of the meta it used, speaker ids).
+    # The compiled sections are encoded already, unless the encoding is "dict".
+    sections: dict[str, tuple[dict | str, list[str], set[str]]]
+
+
+def hash_meta(meta, section_names) -> str:
+    """Hashes the part of the meta data that belongs to the given sections."""
+    return hash_config({name: meta[name] for name in section_names if name in meta})
+
+
+def encode_section(jsection: dict, encoding: str) -> dict | str:
+    """Encodes a compiled section as it is written by JsonWriter, so this work is done
+    by the worker processes and cached with the section.
+    """
+    if encoding == "indent":
+        # Sections are nested two levels deep in the output
+        return json.dumps(jsection, indent=2).replace("\n", "\n    ")
+    elif encoding == "compact":
+        return json.dumps(jsection, separators=(",", ":"))
+    return jsection
+
+
+def compile_file(
+    path,
+    config,
+    env,
+    meta,
+    cache_dir=None,
+    config_hash=None,
+    encoding="dict",
+    optimize=False,
+    bytecode=False,
+) -> CompiledFile:
+    """Parses, lints and compiles the sections of a single file. It is called in the
+    worker processes of main, so it must not change meta (see CompiledFile). The
+    encoding is "dict", "indent" or "compact" (see encode_section). With optimize,
+    the sections are optimized with optimize_section and with bytecode, the bytecode
+    of the expressions is added (see add_bytecode).
+
+    With a cache_dir, the result is cached, so files are only compiled again if they,
+    the config or the meta data of their sections changed.
+    """
+    cache = ParseCache(cache_dir) if cache_dir else None
+    compile_cache = CompileCache(cache_dir) if cache_dir else None
+    src_hash = hash_file(path)
+    options = encoding
+    if optimize:
+        options += ":optimize"
+    if bytecode:
+        options += ":bytecode"
+
+    if compile_cache is not None:
+        if config_hash is None:
+            config_hash = hash_config(config)
+        entry = compile_cache.load(path, src_hash, config_hash, options)
+        if entry is not None:
+            meta_hash, compiled = entry
+            if meta_hash == hash_meta(meta, compiled.sections):
+                return compiled
+
+    parse_ctx = parser.ErrorContext([])
+    lint_ctx = parser.ErrorContext([])
+    linter = Linter(lint_ctx, config, env=env)
+
+    # Sections are linted and compiled one at a time, as they are parsed, so that the
+    # parsed sections never have to be in memory all at once. They are parsed without
+    # positions, which are only needed if lint has something to report.
+    sections = {}
+    for section in iter_dgml_sections_cached(
+        parse_ctx, cache, path, src_hash, positions=False
+    ):
+        first_message = len(lint_ctx.messages)
+        linter.lint_section(path, section)
+        # Duplicate section names are reported by lint
+        if section.name in sections:
+            continue
+        # The build fails anyway, but the errors have to be reported first
+        if any(msg.type == "error" for msg in lint_ctx.messages[first_message:]):
+            continue
+        section_meta = dict(meta.get(section.name, {}))
+        section_speaker_ids = set()
+        jsection = compile_section(path, section, section_meta, section_speaker_ids)
+        used_meta = [k for k in meta.get(section.name, {}) if k not in section_meta]
+        if optimize:
+            optimize_section(jsection, section)
+        if bytecode:
+            add_bytecode(jsection)
+        jsection = encode_section(jsection, encoding)
+        sections[section.name] = (jsection, used_meta, section_speaker_ids)
+
+    compiled = CompiledFile(
+        src_hash,
+        parse_ctx.messages,
+        lint_ctx.messages,
+        linter.get_facts(path),
+        sections,
+    )
+    # Files with syntax errors are not cached, just like in the parse cache
+    if compile_cache is not None and len(parse_ctx.messages) == 0:
+        meta_hash = hash_meta(meta, sections)
+        compile_cache.store(path, src_hash, config_hash, options, meta_hash, compiled)
+    return compiled
+
+
+# Version of the indexed output format, bump it on every incompatible change
+INDEXED_FORMAT_VERSION = 1
+
+
+class IndexedEncoder:
+    """Converts compiled sections to the indexed format: strings (node ids, tags,
+    speaker ids, text, line ids and variable names of lines) are replaced by indices
+    into a shared string table, the tags of text fragments by indices into a table of
+    distinct tag sets and node ids by indices into the node array of the section
+    (see docs/engine_integration.md). The tables are shared by all sections encoded
+    by the same encoder.
+
+    Text fragments are arrays: `[tag set index, string index]` for text and
+    `[tag set index, string index, 1]` for variables, whose string is the variable
+    name. Changing this layout is an incompatible change (see INDEXED_FORMAT_VERSION).
+    """
+
+    def __init__(self):
+        self.strings: list[str] = []
+        self.string_idx: dict[str, int] = {}
+        self.tag_sets: list[dict] = []
+        self.tag_set_idx: dict[tuple, int] = {}
+
+    def string(self, s: str | None) -> int | None:
+        if s is None:
+            return None
+        idx = self.string_idx.get(s)
+        if idx is None:
+            idx = len(self.strings)
+            self.strings.append(s)
+            self.string_idx[s] = idx
+        return idx
+
+    def tag_set(self, tags: dict) -> int:
+        key = tuple(tags.items())
+        idx = self.tag_set_idx.get(key)
+        if idx is None:
+            idx = len(self.tag_sets)
+            self.tag_sets.append(tags)
+            self.tag_set_idx[key] = idx
+        return idx
+
+    def encode_line(self, jline: dict) -> dict:
+        text = []
+        for frag in jline["text"]:
+            if "variable" in frag:
+                text.append(
+                    [self.tag_set(frag["tags"]), self.string(frag["variable"]), 1]
+                )
+            else:
+                text.append([self.tag_set(frag["tags"]), self.string(frag["text"])])
+        ret = {"line_id": self.string(jline["line_id"]), "text": text}
+        if "meta" in jline:
+            ret["meta"] = jline["meta"]
+        return ret
+
+    def encode_section(self, jsection: dict) -> dict:
+        node_idx = {node_id: i for i, node_id in enumerate(jsection["nodes"])}
+        node_idx["end"] = -1
+
+        def ref(node_id):
+            # Invalid node ids are lint errors, so they never get here (see main)
+            return node_idx[node_id]
+
+        nodes = []
+        for jnode in jsection["nodes"].values():
+            node = {}
+            for key, value in jnode.items():
+                if key == "tags":
+                    node[key] = [self.string(tag) for tag in value]
+                elif key in ("next", "dest", "true_dest", "false_dest"):
+                    node[key] = ref(value)
+                elif key == "nodes":
+                    node[key] = [ref(node_id) for node_id in value]
+                elif key == "speaker_id":
+                    node[key] = self.string(value)
+                elif key == "line":
+                    node[key] = self.encode_line(value)
+                elif key == "options":
+                    node[key] = []
+                    for jopt in value:
+                        opt = {
+                            "line": self.encode_line(jopt["line"]),
+                            "dest": ref(jopt["dest"]),
+                        }
+                        if "cond" in jopt:
+                            opt["cond"] = jopt["cond"]
+                        if "bytecode" in jopt:
+                            opt["bytecode"] = jopt["bytecode"]
+                        node[key].append(opt)
+                else:
+                    node[key] = value
+            nodes.append(node)
+
+        section = {"source_file": jsection["source_file"]}
+        if "start_node" in jsection:
+            section["start_node"] = ref(jsection["start_node"])
+        section["internal_loop_free"] = jsection["internal_loop_free"]
+        section["node_ids"] = [self.string(node_id) for node_id in jsection["nodes"]]
+        section["nodes"] = nodes
+        return section
+
+
+class JsonWriter:
+    """Writes the compiled JSON output without having all of it in memory.
+
+    Sections are written to a temporary file as they are added (encoded with
+    encode_section). The other items of the output depend on all sections, so they
+    are written at the end, followed by the sections. The output is the same as that
+    of json.dump(data, indent=2) or, if compact is set, without any whitespace.
+    """
+
+    def __init__(self, path: str, compact: bool = False):
+        self.path = path
+        self.compact = compact
+        self.sections = tempfile.TemporaryFile("w+")
+        self.num_sections = 0
+
+    def add_section(self, name: str, jsection: str):
+        if self.num_sections > 0:
+            self.sections.write(",")
+        if self.compact:
+            self.sections.write(f"{json.dumps(name)}:{jsection}")
+        else:
+            self.sections.write(f"\n    {json.dumps(name)}: {jsection}")
+        self.num_sections += 1
+
+    def finish(self, data: dict, after: dict | None = None):
+        """Writes the output, with the items of data before the sections and the
+        items of after (if any) behind them.
+        """
+        if self.compact:
+            head = json.dumps(data, separators=(",", ":"))
+            # Everything but the closing brace
+            head = head[:-1] + ',"sections":{'
+            tail = "}"
+            if after:
+                tail += "," + json.dumps(after, separators=(",", ":"))[1:-1]
+            tail += "}"
+        else:
+            head = json.dumps(data, indent=2)
+            head = head[:-2] + ',\n  "sections": {'
+            tail = "\n  }" if self.num_sections > 0 else "}"
+            if after:
+                tail += "," + json.dumps(after, indent=2)[1:-2]
+            tail += "\n}"
+
+        self.sections.seek(0)
+        with open(self.path, "w") as f:
+            f.write(head)
+            shutil.copyfileobj(self.sections, f)
+            f.write(tail)
+        self.sections.close()
+
+
 def main(args):
     config = {}
     if args.config:
@@ -90,99 +673,93 @@ def main(args):
             meta = json.load(f)
 
     ctx = parser.ErrorContext([])
+    cache = get_parse_cache(args)
+    env = Environment(config)
+    lint_ctx = parser.ErrorContext([])
+    linter = Linter(lint_ctx, config, env=env)
 
+    files = []
     sources = []
-    for path in args.input:
-        with open(path) as f:
-            src = f.read()
-            src_hash = hashlib.md5(src.encode("utf-8")).hexdigest()
-            sections = parser.parse_dgml(ctx, path, src)
-            if sections is not None:
-                sources.append(Source(path, f.read(), src_hash, sections))
-
-    lint(ctx, config, {s.path: s.sections for s in sources}, [])
+    speaker_ids = set()
+    section_names = set()
+    if args.binary:
+        if args.indexed:
+            sys.exit("--indexed can't be used with --binary")
+        if args.bytecode:
+            sys.exit("--bytecode can't be used with --binary")
+        # The binary writer needs all sections at once
+        sections = {}
+        encoding = "dict"
+        add_section = sections.__setitem__
+    elif args.indexed:
+        # Sections are converted here, as the tables are shared by all of them
+        encoding = "dict"
+        writer = JsonWriter(args.output, args.compact)
+        indexed = IndexedEncoder()
+        json_encoding = "compact" if args.compact else "indent"
+        add_section = lambda name, jsection: writer.add_section(
+            name, encode_section(indexed.encode_section(jsection), json_encoding)
+        )
+    else:
+        encoding = "compact" if args.compact else "indent"
+        writer = JsonWriter(args.output, args.compact)
+        add_section = writer.add_section
+
+    compile_one = functools.partial(
+        compile_file,
+        config=config,
+        env=env,
+        meta=meta,
+        cache_dir=args.cache_dir,
+        config_hash=hash_config(config),
+        encoding=encoding,
+        optimize=args.optimize,
+        bytecode=args.bytecode,
+    )
+    # The results are merged in the order of the input files, so the output does not
+    # depend on the number of jobs
+    for path, compiled in zip(
+        args.input, map_files(args.jobs, compile_one, args.input)
+    ):
+        files.append((path, compiled.source_hash))
+        lint_ctx.messages.extend(compiled.lint_messages)
+        linter.add_facts(path, compiled.facts)
+
+        # Syntax errors always have positions. Files with syntax errors are left out.
+        ctx.messages.extend(compiled.parse_messages)
+        valid = len(compiled.parse_messages) == 0
+        if valid:
+            sources.append(Source(path, compiled.source_hash))
+        for name, (
+            jsection,
+            used_meta,
+            section_speaker_ids,
+        ) in compiled.sections.items():
+            # Duplicate section names are reported by lint
+            if name in section_names:
+                continue
+            for line_id in used_meta:
+                meta[name].pop(line_id)
+            if valid:
+                section_names.add(name)
+                add_section(name, jsection)
+                speaker_ids.update(section_speaker_ids)
+
+    linter.finish()
+
+    if len(lint_ctx.messages) > 0:
+        paths = {msg.loc.file for msg in lint_ctx.messages}
+        lint_ctx = lint_with_positions(config, env, cache, files, linter, paths)
+    ctx.messages.extend(lint_ctx.messages)
 
     parser.print_errors(ctx)
+    if any(msg.type == "error" for msg in ctx.messages):
+        sys.exit(1)
 
     build_id = hashlib.md5()
     for src in sources:
         build_id.update(src.source_hash.encode("utf-8"))
 
-    speaker_ids = set()
-    sections = {}
-
-    for src in sources:
-        for section in src.sections:
-            # lint should have caught this
-            assert section.name not in sections
-
-            section_meta = meta.get(section.name, {})
-            nodes = {}
-            for i, node in enumerate(section.nodes):
-                if i == len(section.nodes) - 1:
-                    next_node = "end"
-                else:
-                    next_node = section.nodes[i + 1].meta.node_id
-
-                # lint should have caught this
-                assert node.meta.node_id not in nodes
-
-                if isinstance(node, parser.RandNode):
-                    nodes[node.meta.node_id] = make_node(node, "rand", nodes=node.nodes)
-                elif isinstance(node, parser.GotoNode):
-                    nodes[node.meta.node_id] = make_node(node, "goto", dest=node.dest)
-                elif isinstance(node, parser.ChoiceNode):
-                    opts = []
-                    for opt in node.options:
-                        opts.append(
-                            {
-                                "line": diag_line_to_json(section_meta, opt.line),
-                                "dest": opt.dest,
-                            }
-                        )
-                        if opt.cond:
-                            opts[-1]["cond"] = expr_to_json(opt.cond.ast)
-                    nodes[node.meta.node_id] = make_node(node, "choice", options=opts)
-                elif isinstance(node, parser.IfNode):
-                    false_dest = (
-                        node.false_dest if node.false_dest is not None else next_node
-                    )
-                    nodes[node.meta.node_id] = make_node(
-                        node,
-                        "if",
-                        cond=expr_to_json(node.cond.ast),
-                        true_dest=node.true_dest,
-                        false_dest=false_dest,
-                    )
-
-                elif isinstance(node, parser.RunNode):
-                    nodes[node.meta.node_id] = make_node(
-                        node, "run", code=expr_to_json(node.code.ast), next=next_node
-                    )
-
-                elif isinstance(node, parser.SayNode):
-                    speaker_ids.add(node.speaker_id)
-                    say_next_node = (
-                        node.next_node if node.next_node is not None else next_node
-                    )
-                    nodes[node.meta.node_id] = make_node(
-                        node,
-                        "say",
-                        speaker_id=node.speaker_id,
-                        line=diag_line_to_json(section_meta, node.line),
-                        next=say_next_node,
-                    )
-
-                else:
-                    sys.exit(f"Unknown node type: {type(node).__name__}")
-
-            sections[section.name] = {
-                "source_file": src.path,
-                "nodes": nodes,
-            }
-            if len(section.nodes) > 0:
-                sections[section.name]["start_node"] = section.nodes[0].meta.node_id
-
     invalid_meta = []
     for section_name, section_meta in meta.items():
         invalid_meta.extend(f"{section_name}::{key}" for key in section_meta.keys())
@@ -192,22 +769,28 @@ def main(args):
             f"Some metadata items don't belong to a line: {', '.join(invalid_meta)}"
         )
 
-    if "speaker_ids" in config:
+    if env.speaker_ids is not None:
         for speaker_id in speaker_ids:
-            if speaker_id not in config["speaker_ids"]:
+            if speaker_id not in env.speaker_ids:
                 sys.exit(f"Invalid speaker id: {speaker_id}")
             speaker_ids = config["speaker_ids"]
 
-    data = {
+    data = {}
+    if args.indexed:
+        data["format"] = "indexed"
+        data["format_version"] = INDEXED_FORMAT_VERSION
+    data |= {
         "build_id": build_id.hexdigest(),
         "speaker_ids": list(speaker_ids),
         "sources": [{"path": s.path, "hash": s.source_hash} for s in sources],
         "environment": config.get("environment", {}),
-        "sections": sections,
     }
 
     if args.binary:
+        data["sections"] = sections
         write_binary(data, args.output)
+    elif args.indexed:
+        tables = {"strings": indexed.strings, "tag_sets": indexed.tag_sets}
+        writer.finish(data, tables)
     else:
-        with open(args.output, "w") as f:
-            json.dump(data, f, indent=2)
+        writer.finish(data)
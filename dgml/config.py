@@ -1,3 +1,4 @@
+import re
 import yaml
 from cerberus import Validator
 import sys
@@ -39,9 +40,46 @@ config_schema = {
             },
         },
     },
+    "lint": {
+        "type": "dict",
+        "schema": {
+            # rule name -> enabled, all rules are enabled by default
+            "rules": {
+                "type": "dict",
+                "keysrules": {"type": "string"},
+                "valuesrules": {"type": "boolean"},
+            },
+        },
+    },
 }
 
 
+class Environment:
+    """The speaker ids and the environment of a config, indexed for lookups by name.
+
+    Every attribute is None if the config doesn't specify it.
+    """
+
+    def __init__(self, config):
+        self.speaker_ids: set[str] | None = None
+        if "speaker_ids" in config:
+            self.speaker_ids = set(config["speaker_ids"])
+
+        env = config.get("environment", {})
+        self.variables: dict[str, dict] | None = None
+        if "variables" in env:
+            self.variables = {var["name"]: var for var in env["variables"]}
+
+        self.markup: dict[str, dict] | None = None
+        # tag name -> compiled parameter regex, for the tags that have a parameter
+        self.markup_parameters: dict[str, re.Pattern] = {}
+        if "markup" in env:
+            self.markup = {tag["name"]: tag for tag in env["markup"]}
+            for tag in env["markup"]:
+                if "parameter" in tag:
+                    self.markup_parameters[tag["name"]] = re.compile(tag["parameter"])
+
+
 def load_config(path: str):
     with open(path) as f:
         config = yaml.load(f, Loader=yaml.SafeLoader)
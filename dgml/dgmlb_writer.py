@@ -20,6 +20,9 @@ DGMLB_NODE_TYPE_RAND = 4
 DGMLB_NODE_TYPE_RUN = 5
 DGMLB_NODE_TYPE_SAY = 6
 
+# section flags (uint32 on disk)
+DGMLB_SECTION_FLAG_INTERNAL_LOOP_FREE = 1
+
 # bytecode ops (uint32 on disk)
 OP_INVALID = 0
 OP_PUSH_BOOL = 1
@@ -41,6 +44,10 @@ OP_GT = 16
 OP_GE = 17
 OP_EQ = 18
 OP_NE = 19
+# Only in the bytecode of the JSON output (see lower_expr with short_circuit), the
+# binary format evaluates both operands of or/and
+OP_JUMP_IF_FALSE = 20
+OP_JUMP_IF_TRUE = 21
 
 # header: char magic[8]; u32 file_size; then 4 spans (sections, speaker_ids, env_variables, env_markup)
 HDR_SIZE = 8 + 4 + (8 * 5)  # 44 bytes
@@ -52,8 +59,8 @@ BYTECODE_FMT = LE + "II"  # op(u32), param(u32)
 
 # on-disk structs formats
 SECTION_FMT = (
-    LE + "III I"
-)  # name_str(off) u32, nodes.offset u32, nodes.count u32, entry_node u32
+    LE + "III I I"
+)  # name_str(off) u32, nodes.offset u32, nodes.count u32, entry_node u32, flags u32
 # Node: matches your struct (order preserved)
 NODE_FMT = LE + "IIII I I I I I I I"  # see pack_node() for fields/comment
 OPTION_FMT = (
@@ -133,19 +140,22 @@ BIN_OP = {
 }
 
 
-def compile_expr(expr: Any, S: StringInterner) -> List[Tuple[int, int]]:
+def lower_expr(expr: Any, short_circuit: bool = False) -> List[Tuple[int, Any]]:
     """
     expr is the dict produced by expr_to_json().
-    returns list of (op, param) pairs.
+    returns list of (op, operand) pairs, with the operands as plain values
+    (bool, int, float or string), see compile_expr for their binary encoding.
+    With short_circuit, or/and only evaluate the rhs if needed: the lhs is followed
+    by a conditional jump over the ops of the rhs (the operand is their count).
     """
     if expr is None:
         return []
     t = expr["type"]
-    out: List[Tuple[int, int]] = []
+    out: List[Tuple[int, Any]] = []
 
     if t.startswith("unary_"):
         op = t[len("unary_") :]
-        out += compile_expr(expr["rhs"], S)
+        out += lower_expr(expr["rhs"], short_circuit)
         if op == "not":
             out.append((OP_NOT, 0))
         elif op == "neg":
@@ -157,43 +167,67 @@ def compile_expr(expr: Any, S: StringInterner) -> List[Tuple[int, int]]:
 
     elif t.startswith("binary_"):
         op = t[len("binary_") :]
-        out += compile_expr(expr["lhs"], S)
-        out += compile_expr(expr["rhs"], S)
+        out += lower_expr(expr["lhs"], short_circuit)
+        rhs = lower_expr(expr["rhs"], short_circuit)
+        if short_circuit and op in ("or", "and"):
+            jump = OP_JUMP_IF_TRUE if op == "or" else OP_JUMP_IF_FALSE
+            out.append((jump, len(rhs)))
+            out += rhs
+            return out
+        out += rhs
         bc = BIN_OP.get(op)
         if not bc:
             raise ValueError(f"unsupported binary op {op}")
         out.append((bc, 0))
 
     elif t == "variable":
-        out.append((OP_GET_VAR, u32(S.offset_of(S.intern(expr["name"])))))
+        out.append((OP_GET_VAR, expr["name"]))
 
     elif t.startswith("literal_"):
         v = expr["value"]
         if t == "literal_bool":
-            out.append((OP_PUSH_BOOL, 1 if v else 0))
+            out.append((OP_PUSH_BOOL, v))
         elif t == "literal_int":
-            out.append((OP_PUSH_INT, u32(v & 0xFFFFFFFF)))
+            out.append((OP_PUSH_INT, v))
         elif t == "literal_float":
-            # bit-cast python float to IEEE-754 single
-            import math
-
-            f32 = struct.pack(LE + "f", float(v))
-            out.append((OP_PUSH_FLOAT, struct.unpack(LE + "I", f32)[0]))
+            out.append((OP_PUSH_FLOAT, v))
         elif t == "literal_str":
-            out.append((OP_PUSH_STRING, u32(S.offset_of(S.intern(v)))))
+            out.append((OP_PUSH_STRING, v))
         else:
             raise ValueError(f"unsupported literal {t}")
 
     elif t == "assign":
         # compile RHS, then SET_VAR name
-        out += compile_expr(expr["value"], S)
-        out.append((OP_SET_VAR, u32(S.offset_of(S.intern(expr["name"])))))
+        out += lower_expr(expr["value"], short_circuit)
+        out.append((OP_SET_VAR, expr["name"]))
     else:
         raise ValueError(f"unknown expr node type {t}")
 
     return out
 
 
+def compile_expr(expr: Any, S: StringInterner) -> List[Tuple[int, int]]:
+    """
+    expr is the dict produced by expr_to_json().
+    returns list of (op, param) pairs.
+    """
+    out: List[Tuple[int, int]] = []
+    for op, v in lower_expr(expr):
+        if op == OP_PUSH_BOOL:
+            out.append((op, 1 if v else 0))
+        elif op == OP_PUSH_INT:
+            out.append((op, u32(v & 0xFFFFFFFF)))
+        elif op == OP_PUSH_FLOAT:
+            # bit-cast python float to IEEE-754 single
+            f32 = struct.pack(LE + "f", float(v))
+            out.append((op, struct.unpack(LE + "I", f32)[0]))
+        elif op in (OP_PUSH_STRING, OP_GET_VAR, OP_SET_VAR):
+            out.append((op, u32(S.offset_of(S.intern(v)))))
+        else:
+            out.append((op, v))
+    return out
+
+
 def emit_bytecode(b: io.BytesIO, code: List[Tuple[int, int]]) -> Tuple[int, int]:
     """Returns (offset, count) in elements (dgml_byte_code)."""
     align(b, 4)
@@ -394,7 +428,7 @@ def write_binary(data: Dict[str, Any], out_path: str) -> None:
     # 3) Start writing
     out = io.BytesIO()
     # header placeholder
-    out.write(b"\x00DGMLB01")  # magic[8] (you wrote comment "D G M L B 0 1")
+    out.write(b"\x00DGMLB02")  # magic[8] (you wrote comment "D G M L B 0 2")
     out.write(b"\x00\x00\x00\x00")  # file_size placeholder
     # 4 spans placeholders (strings, sections, speaker_ids, env_variables, env_markup)
     spans_pos = out.tell()
@@ -479,6 +513,11 @@ def write_binary(data: Dict[str, Any], out_path: str) -> None:
         entry_nid = sec.get("start_node")
         entry_idx = index_per_section[sec_name][entry_nid] if entry_nid else 0
         name_off = S.offset_of(sec_name)
+        section_flags = (
+            DGMLB_SECTION_FLAG_INTERNAL_LOOP_FREE
+            if sec.get("internal_loop_free")
+            else 0
+        )
 
         # placeholder section
         out.write(
@@ -488,6 +527,7 @@ def write_binary(data: Dict[str, Any], out_path: str) -> None:
                 u32(0),  # nodes.offset
                 u32(0),  # nodes.count
                 u32(entry_idx),
+                u32(section_flags),
             )
         )
         sec_records.append((out.tell() - struct.calcsize(SECTION_FMT), sec_name))
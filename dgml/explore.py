@@ -0,0 +1,301 @@
+import json
+import operator
+import sys
+
+from .parser import *
+from .config import Environment, load_config
+from .lint import NodeIndex
+
+BINARY_OPS = {
+    "add": operator.add,
+    "sub": operator.sub,
+    "mul": operator.mul,
+    # Same semantics as the runtime
+    "div": operator.truediv,
+    "lt": operator.lt,
+    "le": operator.le,
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "gt": operator.gt,
+    "ge": operator.ge,
+}
+
+
+class UnsetVariable(Exception):
+    pass
+
+
+class Unset:
+    """Value of the variables that are not set in an initial environment."""
+
+    def __repr__(self):
+        return "UNSET"
+
+
+UNSET = Unset()
+
+
+def get_expr_variables(expr, variables: set[str]):
+    if isinstance(expr, ExprIdent):
+        variables.add(expr.name)
+    elif isinstance(expr, ExprUnary):
+        get_expr_variables(expr.rhs, variables)
+    elif isinstance(expr, ExprBinary):
+        get_expr_variables(expr.lhs, variables)
+        get_expr_variables(expr.rhs, variables)
+    elif isinstance(expr, ExprAssign):
+        get_expr_variables(expr.value, variables)
+
+
+def get_read_variables(section: Section) -> list[str]:
+    """Returns the variables that can change which nodes the section visits: the
+    variables read by conditions and the ones assigned from, if the assigned variable
+    is one of them. All other variables are left out of the explored states.
+    """
+    read = set()
+    assigns = []
+    for node in section.nodes:
+        if isinstance(node, IfNode):
+            get_expr_variables(node.cond.ast, read)
+        elif isinstance(node, ChoiceNode):
+            for opt in node.options:
+                if opt.cond:
+                    get_expr_variables(opt.cond.ast, read)
+        elif isinstance(node, RunNode):
+            assigns.append(node.code.ast)
+
+    changed = True
+    while changed:
+        changed = False
+        for assign in assigns:
+            if assign.name in read:
+                before = len(read)
+                get_expr_variables(assign, read)
+                changed = changed or len(read) != before
+    return sorted(read)
+
+
+class SectionExplorer:
+    """Enumerates the states of one section, i.e. pairs of a node and the values of
+    the variables the section reads, and records which branches and options were
+    taken.
+
+    States are tuples (node index, tuple of variable values), so they are cheap to
+    hash and deduplicate. Expressions are compiled to closures over the value tuple
+    once per distinct expression (they are hash-consed, see parser.make_expr).
+    """
+
+    def __init__(self, section: Section, max_states: int):
+        self.section = section
+        self.max_states = max_states
+        self.index = NodeIndex(section)
+        self.variables = get_read_variables(section)
+        self.var_idx = {name: i for i, name in enumerate(self.variables)}
+        # expression -> function of the variable values
+        self.compiled = {}
+
+        self.reached: set[int] = set()
+        self.num_states = 0
+        self.exhausted = False
+        # node index -> taken results of the condition, for IF nodes
+        self.if_results: dict[int, set[bool]] = {}
+        # (node index, option index) of the enabled CHOICE options
+        self.enabled_options: set[tuple[int, int]] = set()
+        # node indices of CHOICE nodes that were reached with every option disabled
+        self.dead_ends: set[int] = set()
+        # node index -> message of an error while evaluating it
+        self.errors: dict[int, str] = {}
+
+    def get_values(self, env: dict) -> tuple:
+        return tuple(env.get(name, UNSET) for name in self.variables)
+
+    def compile_expr(self, expr):
+        func = self.compiled.get(expr)
+        if func is None:
+            func = self.compile_expr_uncached(expr)
+            self.compiled[expr] = func
+        return func
+
+    def compile_expr_uncached(self, expr):
+        if isinstance(expr, ExprLiteral):
+            value = expr.value
+            return lambda values: value
+        elif isinstance(expr, ExprIdent):
+            i = self.var_idx[expr.name]
+            name = expr.name
+
+            def ident(values):
+                value = values[i]
+                if value is UNSET:
+                    raise UnsetVariable(f"Variable {name} is not set")
+                return value
+
+            return ident
+        elif isinstance(expr, ExprUnary):
+            rhs = self.compile_expr(expr.rhs)
+            return lambda values: not rhs(values)
+        elif isinstance(expr, ExprBinary):
+            lhs = self.compile_expr(expr.lhs)
+            rhs = self.compile_expr(expr.rhs)
+            if expr.op == "or":
+                return lambda values: lhs(values) or rhs(values)
+            elif expr.op == "and":
+                return lambda values: lhs(values) and rhs(values)
+            op = BINARY_OPS[expr.op]
+            return lambda values: op(lhs(values), rhs(values))
+        raise AssertionError("Invalid expr node")
+
+    def get_dest(self, node_id: str) -> int | None:
+        # Invalid node ids are reported by lint
+        return self.index.find_node(node_id)
+
+    def get_next(self, i: int, node_id: str | None) -> int | None:
+        return self.get_dest(node_id) if node_id is not None else i + 1
+
+    def successors(self, i: int, values: tuple) -> tuple[list[int | None], tuple]:
+        """Returns the node indices that follow node i with the given values, and
+        the values after the node.
+        """
+        node = self.section.nodes[i]
+        if isinstance(node, SayNode):
+            return [self.get_next(i, node.next_node)], values
+        elif isinstance(node, GotoNode):
+            return [self.get_dest(node.dest)], values
+        elif isinstance(node, RandNode):
+            return [self.get_dest(n) for n in node.nodes], values
+        elif isinstance(node, IfNode):
+            result = bool(self.compile_expr(node.cond.ast)(values))
+            self.if_results.setdefault(i, set()).add(result)
+            if result:
+                return [self.get_dest(node.true_dest)], values
+            return [self.get_next(i, node.false_dest)], values
+        elif isinstance(node, RunNode):
+            assign = node.code.ast
+            if assign.name in self.var_idx:
+                value = self.compile_expr(assign.value)(values)
+                j = self.var_idx[assign.name]
+                values = values[:j] + (value,) + values[j + 1 :]
+            return [i + 1], values
+        elif isinstance(node, ChoiceNode):
+            dests = []
+            for j, opt in enumerate(node.options):
+                if opt.cond is None or self.compile_expr(opt.cond.ast)(values):
+                    self.enabled_options.add((i, j))
+                    dests.append(self.get_dest(opt.dest))
+            if len(dests) == 0:
+                self.dead_ends.add(i)
+            return dests, values
+        return [], values
+
+    def explore(self, initial_envs: list[dict]):
+        end_idx = self.index.end_idx
+        visited = set()
+        stack = [(0, self.get_values(env)) for env in initial_envs]
+        while stack:
+            state = stack.pop()
+            if state in visited:
+                continue
+            if len(visited) >= self.max_states:
+                self.exhausted = True
+                break
+            visited.add(state)
+            i, values = state
+            if i == end_idx:
+                continue
+            self.reached.add(i)
+            try:
+                dests, values = self.successors(i, values)
+            except (UnsetVariable, ArithmeticError, TypeError) as exc:
+                self.errors.setdefault(i, str(exc))
+                continue
+            for dest in dests:
+                if dest is not None:
+                    stack.append((dest, values))
+        self.num_states = len(visited)
+
+    def report(self, ctx: ErrorContext, path: str):
+        def add(type, loc, message):
+            ctx.messages.append(Message(type, FileLocation(path, loc), message))
+
+        if self.exhausted:
+            add(
+                "warning",
+                self.section.loc,
+                f"Stopped exploring section {self.section.name} after "
+                f"{self.max_states} states, results are incomplete",
+            )
+        for i, node in enumerate(self.section.nodes):
+            if i not in self.reached:
+                continue
+            if i in self.errors:
+                add("error", node.meta.loc, self.errors[i])
+            if i in self.dead_ends:
+                add("error", node.meta.loc, "Every option of CHOICE can be disabled")
+            # Branches that were not taken might still be taken in unexplored states
+            if self.exhausted:
+                continue
+            if isinstance(node, IfNode) and len(self.if_results.get(i, ())) == 1:
+                result = "true" if True in self.if_results[i] else "false"
+                add(
+                    "warning",
+                    node.cond.loc,
+                    f"Condition of IF is always {result}, the other branch is never taken",
+                )
+            elif isinstance(node, ChoiceNode):
+                for j, opt in enumerate(node.options):
+                    if opt.cond is not None and (i, j) not in self.enabled_options:
+                        add("warning", opt.cond.loc, "Option is never enabled")
+
+
+def load_initial_envs(env: Environment, paths: list[str]) -> list[dict]:
+    """Returns the initial environments to explore from: the defaults of the config,
+    updated with each environment in the JSON files (an object or a list of objects).
+    """
+    defaults = {}
+    for name, var in (env.variables or {}).items():
+        if "default" in var:
+            defaults[name] = var["default"]
+    if not paths:
+        return [defaults]
+
+    envs = []
+    for path in paths:
+        with open(path) as f:
+            data = json.load(f)
+        for overrides in data if isinstance(data, list) else [data]:
+            envs.append({**defaults, **overrides})
+    return envs
+
+
+def main(args):
+    config = {}
+    if args.config:
+        config = load_config(args.config)
+    initial_envs = load_initial_envs(Environment(config), args.env)
+
+    ctx = ErrorContext([])
+    for path in args.input:
+        with open(path) as f:
+            source = f.read()
+        sections = parse_dgml(ctx, path, source)
+        # Syntax errors have already been reported
+        if sections is None:
+            continue
+        for section in sections:
+            if args.section and section.name not in args.section:
+                continue
+            explorer = SectionExplorer(section, args.max_states)
+            explorer.explore(initial_envs)
+            explorer.report(ctx, path)
+            if args.stats:
+                print(
+                    f"{section.name}: {explorer.num_states} states, "
+                    f"{len(explorer.variables)} variables",
+                    file=sys.stderr,
+                )
+
+    print_errors(ctx)
+    if len(ctx.messages) > 0:
+        sys.exit(1)
+    elif not args.quiet:
+        print("No problems found", file=sys.stderr)
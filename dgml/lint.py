@@ -1,519 +1,1125 @@
+import fnmatch
+import functools
+import os
 import sys
 import json
-import re
-from dataclasses import dataclass
-from collections.abc import Iterable
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import cached_property
 from pathlib import Path
 
-import lark
-from watchfiles import watch, Change
-import yaml
-
 from .parser import *
-from .config import load_config
+from .cache import (
+    LintCache,
+    LintResult,
+    ParseCache,
+    hash_config,
+    hash_source,
+    parse_dgml_cached,
+)
+from .config import Environment, load_config
+
+
+class NodeIndex:
+    """Maps the node ids of one section to node indices. It is built once per section
+    and shared by the lint passes that follow node ids.
+    """
+
+    def __init__(self, section: Section):
+        self.section = section
+        self.end_idx = len(section.nodes)
+        self.node_idx: dict[str, int] = {}
+        for i, node in enumerate(section.nodes):
+            # Duplicates are reported by lint_unique_node_ids, the first node counts
+            self.node_idx.setdefault(node.meta.node_id, i)
+
+    def find_node(self, node_id: str) -> int | None:
+        idx = self.node_idx.get(node_id)
+        if idx is None and node_id == "end":
+            return self.end_idx
+        return idx
+
+
+class ControlFlowGraph:
+    """The control flow of one section, for the lint passes that have to follow it.
+
+    The explicit edges (GOTO, RAND, IF, CHOICE and -> targets) of node i are
+    jumps[jump_start[i]:jump_start[i + 1]]. The edge from a node to the next one is
+    implicit and only marked in falls_through. Node index end_idx stands for the end
+    of the section and has no node. Invalid node ids have no edges (see
+    lint_valid_node_ids).
+    """
+
+    def __init__(self, index: NodeIndex):
+        self.index = index
+        self.end_idx = index.end_idx
+        self.jump_start: list[int] = [0]
+        self.jumps: list[int] = []
+        self.falls_through: list[bool] = []
+        for node in index.section.nodes:
+            dests, falls_through = get_node_dests(node)
+            for dest in dests:
+                dest_idx = index.find_node(dest)
+                if dest_idx is not None:
+                    self.jumps.append(dest_idx)
+            self.jump_start.append(len(self.jumps))
+            self.falls_through.append(falls_through)
+
+    def successors(self, idx: int) -> list[int]:
+        succ = self.jumps[self.jump_start[idx] : self.jump_start[idx + 1]]
+        if self.falls_through[idx]:
+            succ.append(idx + 1)
+        return succ
+
+    def reachable_from(self, start: int) -> list[bool]:
+        reachable = [False] * (self.end_idx + 1)
+        worklist = [start]
+        while worklist:
+            idx = worklist.pop()
+            if reachable[idx]:
+                continue
+            reachable[idx] = True
+            if idx == self.end_idx:
+                continue
+            for j in range(self.jump_start[idx], self.jump_start[idx + 1]):
+                if not reachable[self.jumps[j]]:
+                    worklist.append(self.jumps[j])
+            if self.falls_through[idx] and not reachable[idx + 1]:
+                worklist.append(idx + 1)
+        return reachable
+
+    @cached_property
+    def internal_loops(self) -> list[list[int]]:
+        """The cycles of internal nodes (all but SAY and CHOICE), as the sorted node
+        indices of the strongly connected components that contain a cycle. A runtime
+        could loop through these forever without returning from advance.
+        """
+        nodes = self.index.section.nodes
+        n = self.end_idx
+        internal = [not isinstance(node, (SayNode, ChoiceNode)) for node in nodes]
+
+        # Every cycle needs a backward edge, most sections don't have one
+        has_back_edge = any(
+            j <= i and j < n and internal[j]
+            for i in range(n)
+            if internal[i]
+            for j in self.jumps[self.jump_start[i] : self.jump_start[i + 1]]
+        )
+        if not has_back_edge:
+            return []
+
+        # Tarjan's algorithm, with an explicit stack instead of recursion
+        order = [-1] * n
+        low = [0] * n
+        on_stack = [False] * n
+        stack = []
+        counter = 0
+        loops = []
+        for root in range(n):
+            if not internal[root] or order[root] != -1:
+                continue
+            order[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            work = [(root, iter(self.successors(root)))]
+            while work:
+                v, succ = work[-1]
+                for w in succ:
+                    if w >= n or not internal[w]:
+                        continue
+                    if order[w] == -1:
+                        order[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        on_stack[w] = True
+                        work.append((w, iter(self.successors(w))))
+                        break
+                    elif on_stack[w]:
+                        low[v] = min(low[v], order[w])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[v])
+                    if low[v] == order[v]:
+                        scc = []
+                        while True:
+                            w = stack.pop()
+                            on_stack[w] = False
+                            scc.append(w)
+                            if w == v:
+                                break
+                        if len(scc) > 1 or v in self.successors(v):
+                            loops.append(sorted(scc))
+        loops.sort()
+        return loops
+
+
+def get_node_dests(node: Node) -> tuple[list[str], bool]:
+    """Returns the node ids a node can continue with and whether it can continue with
+    the next node.
+    """
+    if isinstance(node, RandNode):
+        return node.nodes, False
+    elif isinstance(node, GotoNode):
+        return [node.dest], False
+    elif isinstance(node, ChoiceNode):
+        return [opt.dest for opt in node.options], False
+    elif isinstance(node, IfNode):
+        if node.false_dest:
+            return [node.true_dest, node.false_dest], False
+        return [node.true_dest], True
+    elif isinstance(node, RunNode):
+        return [], True
+    elif isinstance(node, SayNode):
+        if node.next_node:
+            return [node.next_node], False
+        return [], True
+    else:
+        return [], False
 
 
-def get_duplicates(
-    seq: Iterable[tuple[str, FileLocation]]
-) -> list[tuple[str, FileLocation]]:
-    s = set()
-    duplicates = []
-    for val, loc in seq:
-        if val in s:
-            duplicates.append((val, loc))
-        s.add(val)
-    return duplicates
+class Rule:
+    """Base class of the lint rules.
 
+    The linter walks every section once and calls the hooks of all enabled rules:
+    on_section for every section, on_node for every node and on_line for every
+    dialog line (of SAY nodes and CHOICE options). finish is called after the last
+    section, for rules that need to see all sections. Only hooks that a rule
+    overrides are called. Locations should only be created when there is something
+    to report (see report).
+    """
 
-def lint_unique_section_names(ctx, config, sources):
-    for path, sections in sources.items():
-        dup_sec_names = get_duplicates(
-            (s.name, FileLocation(path, s.loc)) for s in sections
-        )
-        for name, loc in dup_sec_names:
-            ctx.messages.append(
-                Message("error", loc, f"Duplicate section name: {name}")
-            )
+    # Name used to enable or disable the rule in the config
+    name = ""
 
+    def __init__(self, linter: "Linter"):
+        self.linter = linter
+        self.ctx = linter.ctx
 
-def get_line_ids(path, node):
-    if isinstance(node, SayNode) and node.line.line_id is not None:
-        return [(node.line.line_id, FileLocation(path, node.line.loc))]
-    elif isinstance(node, ChoiceNode):
-        return [
-            (o.line.line_id, FileLocation(path, o.line.loc))
-            for o in node.options
-            if o.line.line_id is not None
-        ]
-    else:
-        return []
+    @classmethod
+    def applies_to(cls, env: Environment) -> bool:
+        """Whether the rule has everything it needs in the config."""
+        return True
 
+    def report(self, type: str, path: str, loc: SourceLoc, message: str):
+        self.ctx.messages.append(Message(type, FileLocation(path, loc), message))
 
-def lint_unique_ids(ctx, config, sources):
-    line_ids = []
-    for path, sections in sources.items():
-        for section in sections:
-            dup_node_ids = get_duplicates(
-                (n.meta.node_id, FileLocation(path, n.meta.loc)) for n in section.nodes
-            )
-            for node_id, loc in dup_node_ids:
-                ctx.messages.append(
-                    Message("error", loc, f"Duplicate node id: {node_id}")
-                )
-            for node in section.nodes:
-                line_ids.extend(get_line_ids(path, node))
+    def on_section(self, path: str, cfg: "ControlFlowGraph"):
+        pass
 
-    for line_id, loc in get_duplicates(line_ids):
-        ctx.messages.append(Message("error", loc, f"Duplicate line id: {line_id}"))
+    def on_node(self, path: str, cfg: "ControlFlowGraph", node: Node):
+        pass
 
+    def on_line(self, path: str, line: DialogLine):
+        pass
 
-def lint_valid_speaker_id(ctx, config, sources):
-    if "speaker_ids" not in config:
-        return
-    valid_speaker_ids = config["speaker_ids"]
+    def finish(self):
+        pass
 
-    for path, sections in sources.items():
-        for section in sections:
-            for node in section.nodes:
-                if isinstance(node, SayNode):
-                    if not node.speaker_id in valid_speaker_ids:
-                        ctx.messages.append(
-                            Message(
-                                "error",
-                                FileLocation(path, node.meta.loc),
-                                f"Invalid speaker: {node.speaker_id}",
-                            )
-                        )
+    def get_facts(self, path: str):
+        """Returns what finish needs to know about the sections of path, so it can be
+        cached or passed to another linter (see add_facts).
+        """
+        return None
 
+    def add_facts(self, path: str, facts):
+        """Adds the facts about path returned by get_facts of the same rule, instead of
+        linting the sections of path again. It can be called more than once for the
+        same path, e.g. with the facts of single sections.
+        """
+        pass
 
-def find_node(section: Section, node_id: str) -> int | None:
-    for i, n in enumerate(section.nodes):
-        if n.meta.node_id == node_id:
-            return i
-    if node_id == "end":
-        return len(section.nodes)
-    return None
+    def remove_facts(self, path: str):
+        """Forgets the facts about path, so the rule can be used for it again."""
+        pass
 
 
-def get_node_idx(section: Section, node_id: str) -> int:
-    idx = find_node(section, node_id)
-    if idx == None:
-        sys.exit(f"Invalid node id: {node_id}")
-    return idx
+RULES: dict[str, type[Rule]] = {}
 
 
-def check_node_id(ctx, section, loc, node_id):
-    if find_node(section, node_id) == None:
-        ctx.messages.append(Message("error", loc, f"Invalid node id: {node_id}"))
+def register_rule(rule: type[Rule]) -> type[Rule]:
+    RULES[rule.name] = rule
+    return rule
 
 
-def lint_valid_node_ids(ctx, config, sources):
-    for path, sections in sources.items():
-        for section in sections:
-            for node in section.nodes:
-                node_loc = FileLocation(path, node.meta.loc)
+@register_rule
+class UniqueSectionNames(Rule):
+    name = "unique-section-names"
 
-                if node.meta.node_id == "end":
-                    ctx.messages.append(
-                        Message("error", node_loc, "'end' is a reserved node id")
-                    )
+    def __init__(self, linter):
+        super().__init__(linter)
+        # path -> [(name, loc)]
+        self.names: dict[str, list[tuple[str, SourceLoc]]] = {}
 
-                if isinstance(node, RandNode):
-                    for n in node.nodes:
-                        check_node_id(ctx, section, node_loc, n)
-                elif isinstance(node, GotoNode):
-                    check_node_id(ctx, section, node_loc, node.dest)
-                elif isinstance(node, ChoiceNode):
-                    for opt in node.options:
-                        check_node_id(
-                            ctx, section, FileLocation(path, opt.line.loc), opt.dest
-                        )
-                elif isinstance(node, IfNode):
-                    check_node_id(ctx, section, node_loc, node.true_dest)
-                    if node.false_dest:
-                        check_node_id(
-                            ctx,
-                            section,
-                            node_loc,
-                            node.false_dest,
-                        )
-                elif isinstance(node, SayNode):
-                    if node.next_node:
-                        check_node_id(ctx, section, node_loc, node.next_node)
+    def on_section(self, path, cfg):
+        section = cfg.index.section
+        self.names.setdefault(path, []).append((section.name, section.loc))
 
+    def finish(self):
+        seen = set()
+        for path, names in self.names.items():
+            for name, loc in names:
+                if name in seen:
+                    self.report("error", path, loc, f"Duplicate section name: {name}")
+                seen.add(name)
 
-def reach_node(reachable: list[bool], path: str, section: Section, idx: int):
-    if idx >= len(section.nodes):  # probably @end
-        return
+    def get_facts(self, path):
+        return self.names.get(path, [])
 
-    # We've already been here, avoid infinite recursion
-    if reachable[idx]:
-        return
+    def add_facts(self, path, facts):
+        self.names.setdefault(path, []).extend(facts)
 
-    reachable[idx] = True
-    node = section.nodes[idx]
-    if isinstance(node, RandNode):
-        for n in node.nodes:
-            reach_node(reachable, path, section, get_node_idx(section, n))
-    elif isinstance(node, GotoNode):
-        reach_node(reachable, path, section, get_node_idx(section, node.dest))
-    elif isinstance(node, ChoiceNode):
-        for opt in node.options:
-            reach_node(reachable, path, section, get_node_idx(section, opt.dest))
-    elif isinstance(node, IfNode):
-        reach_node(reachable, path, section, get_node_idx(section, node.true_dest))
-        if node.false_dest:
-            reach_node(reachable, path, section, get_node_idx(section, node.false_dest))
-        else:
-            reach_node(reachable, path, section, idx + 1)
-    elif isinstance(node, RunNode):
-        reach_node(reachable, path, section, idx + 1)
-    elif isinstance(node, SayNode):
-        if node.next_node:
-            reach_node(reachable, path, section, get_node_idx(section, node.next_node))
-        else:
-            reach_node(reachable, path, section, idx + 1)
+    def remove_facts(self, path):
+        self.names.pop(path, None)
 
 
-def lint_unreachable_nodes(ctx, config, sources):
-    for path, sections in sources.items():
-        for section in sections:
-            reachable = [False for n in section.nodes]
-            reach_node(reachable, path, section, 0)
-            for i, r in enumerate(reachable):
-                if not r:
-                    ctx.messages.append(
-                        Message(
-                            "warning",
-                            FileLocation(path, section.nodes[i].meta.loc),
-                            f"Unreachable node",
-                        )
-                    )
+@register_rule
+class UniqueNodeIds(Rule):
+    name = "unique-node-ids"
+
+    def on_section(self, path, cfg):
+        node_idx = cfg.index.node_idx
+        for i, node in enumerate(cfg.index.section.nodes):
+            if node_idx[node.meta.node_id] != i:
+                self.report(
+                    "error",
+                    path,
+                    node.meta.loc,
+                    f"Duplicate node id: {node.meta.node_id}",
+                )
+
+
+@register_rule
+class UniqueLineIds(Rule):
+    name = "unique-line-ids"
+
+    def __init__(self, linter):
+        super().__init__(linter)
+        # path -> [(line id, loc)]
+        self.line_ids: dict[str, list[tuple[str, SourceLoc]]] = {}
+
+    def on_line(self, path, line):
+        if line.line_id is not None:
+            self.line_ids.setdefault(path, []).append((line.line_id, line.loc))
+
+    def finish(self):
+        seen = set()
+        for path, line_ids in self.line_ids.items():
+            for line_id, loc in line_ids:
+                if line_id in seen:
+                    self.report("error", path, loc, f"Duplicate line id: {line_id}")
+                seen.add(line_id)
+
+    def get_facts(self, path):
+        return self.line_ids.get(path, [])
+
+    def add_facts(self, path, facts):
+        self.line_ids.setdefault(path, []).extend(facts)
+
+    def remove_facts(self, path):
+        self.line_ids.pop(path, None)
+
+
+@register_rule
+class ValidNodeIds(Rule):
+    name = "valid-node-ids"
+
+    def check_node_id(self, path, index, loc, node_id):
+        if index.find_node(node_id) is None:
+            self.report("error", path, loc, f"Invalid node id: {node_id}")
+
+    def on_node(self, path, cfg, node):
+        index = cfg.index
+        node_loc = node.meta.loc
+
+        if node.meta.node_id == "end":
+            self.report("error", path, node_loc, "'end' is a reserved node id")
+
+        if isinstance(node, RandNode):
+            for n in node.nodes:
+                self.check_node_id(path, index, node_loc, n)
+        elif isinstance(node, GotoNode):
+            self.check_node_id(path, index, node_loc, node.dest)
+        elif isinstance(node, ChoiceNode):
+            for opt in node.options:
+                self.check_node_id(path, index, opt.line.loc, opt.dest)
+        elif isinstance(node, IfNode):
+            self.check_node_id(path, index, node_loc, node.true_dest)
+            if node.false_dest:
+                self.check_node_id(path, index, node_loc, node.false_dest)
+        elif isinstance(node, SayNode):
+            if node.next_node:
+                self.check_node_id(path, index, node_loc, node.next_node)
+
+
+@register_rule
+class ValidSpeakerIds(Rule):
+    name = "valid-speaker-ids"
+
+    @classmethod
+    def applies_to(cls, env):
+        return env.speaker_ids is not None
+
+    def on_node(self, path, cfg, node):
+        if isinstance(node, SayNode):
+            if not node.speaker_id in self.linter.env.speaker_ids:
+                self.report(
+                    "error", path, node.meta.loc, f"Invalid speaker: {node.speaker_id}"
+                )
+
+
+@register_rule
+class UnreachableNodes(Rule):
+    name = "unreachable-nodes"
+
+    def on_section(self, path, cfg):
+        reachable = cfg.reachable_from(0)
+        for i, node in enumerate(cfg.index.section.nodes):
+            if not reachable[i]:
+                self.report("warning", path, node.meta.loc, f"Unreachable node")
 
 
-def find_env_var(env_vars, name):
-    for var in env_vars:
-        if var["name"] == name:
-            return var
-    return None
+@register_rule
+class InternalLoops(Rule):
+    name = "internal-loops"
 
+    def on_section(self, path, cfg):
+        nodes = cfg.index.section.nodes
+        for loop in cfg.internal_loops:
+            node_ids = ", ".join(nodes[i].meta.node_id for i in loop)
+            self.report(
+                "error",
+                path,
+                nodes[loop[0]].meta.loc,
+                f"Loop without SAY or CHOICE through nodes: {node_ids}",
+            )
+
+
+@register_rule
+class ValidInterpolations(Rule):
+    name = "valid-interpolations"
 
-def check_valid_interpolations(ctx, env_vars, path, line):
-    for seg in line.text:
-        if isinstance(seg, VariableFragment):
-            if find_env_var(env_vars, seg.variable_name) == None:
-                ctx.messages.append(
-                    Message(
+    @classmethod
+    def applies_to(cls, env):
+        return env.variables is not None
+
+    def on_line(self, path, line):
+        for seg in line.text:
+            if isinstance(seg, VariableFragment):
+                if seg.variable_name not in self.linter.env.variables:
+                    self.report(
                         "warning",
-                        FileLocation(path, line.loc),
+                        path,
+                        line.loc,
                         f"Invalid variable interpolation: {seg.variable_name}",
                     )
-                )
 
 
-def lint_valid_interpolations(ctx, config, sources):
-    if "environment" not in config:
-        return
-    if "variables" not in config["environment"]:
-        return
-    env_vars = config["environment"]["variables"]
-
-    for path, sections in sources.items():
-        for section in sections:
-            for node in section.nodes:
-                if isinstance(node, ChoiceNode):
-                    for opt in node.options:
-                        check_valid_interpolations(ctx, env_vars, path, opt.line)
-                elif isinstance(node, SayNode):
-                    check_valid_interpolations(ctx, env_vars, path, node.line)
-
-
-def check_valid_markup_nesting(ctx, markup, path, line):
-    markup_stack = []
-    for seg in line.text:
-        if isinstance(seg, TagOpen):
-            markup_stack.append(seg.name)
-        elif isinstance(seg, TagClose):
-            if len(markup_stack) == 0 or markup_stack[-1] != seg.name:
-                ctx.messages.append(
-                    Message(
-                        "warning",
-                        FileLocation(path, line.loc),
+@register_rule
+class MarkupNesting(Rule):
+    name = "markup-nesting"
+
+    def on_line(self, path, line):
+        markup_stack = []
+        for seg in line.text:
+            if isinstance(seg, TagOpen):
+                markup_stack.append(seg.name)
+            elif isinstance(seg, TagClose):
+                # The tags of the text fragments are undefined, so this can't be
+                # compiled (unclosed tags are simply closed at the end of the line)
+                if len(markup_stack) == 0 or markup_stack[-1] != seg.name:
+                    self.report(
+                        "error",
+                        path,
+                        line.loc,
                         f"Invalid nesting of markup tags: {seg.name}",
                     )
-                )
-                return
-            markup_stack.pop()
+                    return
+                markup_stack.pop()
 
-    if len(markup_stack) > 0:
-        ctx.messages.append(
-            Message(
+        if len(markup_stack) > 0:
+            self.report(
                 "warning",
-                FileLocation(path, line.loc),
+                path,
+                line.loc,
                 f"Unclosed markup tags: {', '.join(markup_stack)}",
             )
-        )
 
 
-def lint_markup_nesting(ctx, config, sources):
-    if "environment" not in config:
-        return
-    if "markup" not in config["environment"]:
-        return
-    markup = config["environment"]["markup"]
+@register_rule
+class KnownMarkup(Rule):
+    name = "known-markup"
 
-    for path, sections in sources.items():
-        for section in sections:
-            for node in section.nodes:
-                if isinstance(node, ChoiceNode):
-                    for opt in node.options:
-                        check_valid_markup_nesting(ctx, markup, path, opt.line)
-                elif isinstance(node, SayNode):
-                    check_valid_markup_nesting(ctx, markup, path, node.line)
-
-
-def find_markup_tag(markup, tag_name):
-    for tag in markup:
-        if tag["name"] == tag_name:
-            return tag
-    return None
-
-
-def check_valid_markup(ctx, markup, path, line):
-    line_loc = FileLocation(path, line.loc)
-    for seg in line.text:
-        if isinstance(seg, TagOpen):
-            tag = find_markup_tag(markup, seg.name)
-            if tag is None:
-                ctx.messages.append(
-                    Message("warning", line_loc, f"Invalid markup tag: {seg.name}")
-                )
-                continue
+    @classmethod
+    def applies_to(cls, env):
+        return env.markup is not None
 
-            if seg.parameter is not None:
-                if "parameter" not in tag:
-                    ctx.messages.append(
-                        Message(
+    def on_line(self, path, line):
+        env = self.linter.env
+        for seg in line.text:
+            if isinstance(seg, TagOpen):
+                tag = env.markup.get(seg.name)
+                if tag is None:
+                    self.report(
+                        "warning", path, line.loc, f"Invalid markup tag: {seg.name}"
+                    )
+                    continue
+
+                if seg.parameter is not None:
+                    if "parameter" not in tag:
+                        self.report(
                             "warning",
-                            line_loc,
+                            path,
+                            line.loc,
                             f"Parameter not allowed for markup tag: {seg.name}",
                         )
-                    )
-                else:
-                    if not re.fullmatch(tag["parameter"], seg.parameter):
-                        ctx.messages.append(
-                            Message(
+                    else:
+                        parameter_re = env.markup_parameters[seg.name]
+                        if not parameter_re.fullmatch(seg.parameter):
+                            self.report(
                                 "warning",
-                                line_loc,
+                                path,
+                                line.loc,
                                 f"Invalid parameter for markup tag '{seg.name}': {seg.parameter}",
                             )
-                        )
-        elif isinstance(seg, TagClose):
-            tag = find_markup_tag(markup, seg.name)
-            if tag is None:
-                ctx.messages.append(
-                    Message("error", line_loc, f"Invalid markup tag: {seg.name}")
-                )
-
-
-def lint_known_markup(ctx, config, sources):
-    if "environment" not in config:
-        return
-    if "markup" not in config["environment"]:
-        return
-    markup = config["environment"]["markup"]
-
-    for path, sections in sources.items():
-        for section in sections:
-            for node in section.nodes:
-                if isinstance(node, ChoiceNode):
-                    for opt in node.options:
-                        check_valid_markup(ctx, markup, path, opt.line)
-                elif isinstance(node, SayNode):
-                    check_valid_markup(ctx, markup, path, node.line)
+            elif isinstance(seg, TagClose):
+                if seg.name not in env.markup:
+                    self.report(
+                        "error", path, line.loc, f"Invalid markup tag: {seg.name}"
+                    )
 
 
 def is_num_type(type):
     return type == "int" or type == "float"
 
 
-def get_expr_type(env_vars, expr):
-    if isinstance(expr, ExprUnary):
-        if expr.op == "not":
-            if get_expr_type(env_vars, expr.rhs) != "bool":
-                raise TypeError("Operand for 'not' must be of type bool")
-            return "bool"
-        else:
-            raise TypeError(f"Invalid unary operand: {expr.op}")
-    elif isinstance(expr, ExprBinary):
-        if expr.op in ("or", "and"):
-            if get_expr_type(env_vars, expr.lhs) != "bool":
-                raise TypeError(f"Lhs of {expr.op} operator must be bool")
-            if get_expr_type(env_vars, expr.rhs) != "bool":
-                raise TypeError(f"Rhs of {expr.op} operator must be bool")
-            return "bool"
-        elif expr.op in ("lt", "le", "gt", "ge", "add", "sub", "mul", "div"):
-            lhs_type = get_expr_type(env_vars, expr.lhs)
-            if not is_num_type(lhs_type):
-                raise TypeError(f"Lhs of {expr.op} operator must be number")
-            rhs_type = get_expr_type(env_vars, expr.rhs)
-            if not is_num_type(rhs_type):
-                raise TypeError(f"Rhs of {expr.op} operator must be number")
-            if expr.op in ("lt", "le", "gt", "ge"):
+class ExprTypeChecker:
+    """Infers the types of expressions for one set of environment variables.
+
+    Expressions are hash-consed (see parser.make_expr), so the results can be memoized
+    per expression object and every distinct expression is only checked once, however
+    often it occurs.
+    """
+
+    def __init__(self, env: Environment):
+        self.var_types = {name: var["type"] for name, var in env.variables.items()}
+        # expression -> type or the message of the TypeError. The keys are weak, so
+        # a long-lived checker (see Project) doesn't keep old expressions alive.
+        self.memo: weakref.WeakKeyDictionary[
+            ExprNode | ExprAssign, tuple[str | None, str | None]
+        ] = weakref.WeakKeyDictionary()
+
+    def get_type(self, expr) -> str:
+        res = self.memo.get(expr)
+        if res is None:
+            try:
+                res = (self.infer_type(expr), None)
+            except TypeError as exc:
+                res = (None, str(exc))
+            self.memo[expr] = res
+        expr_type, error = res
+        if error is not None:
+            raise TypeError(error)
+        return expr_type
+
+    def infer_type(self, expr) -> str:
+        if isinstance(expr, ExprUnary):
+            if expr.op == "not":
+                if self.get_type(expr.rhs) != "bool":
+                    raise TypeError("Operand for 'not' must be of type bool")
                 return "bool"
-            elif lhs_type == "int" and rhs_type == "int":
-                return "int"
             else:
+                raise TypeError(f"Invalid unary operand: {expr.op}")
+        elif isinstance(expr, ExprBinary):
+            if expr.op in ("or", "and"):
+                if self.get_type(expr.lhs) != "bool":
+                    raise TypeError(f"Lhs of {expr.op} operator must be bool")
+                if self.get_type(expr.rhs) != "bool":
+                    raise TypeError(f"Rhs of {expr.op} operator must be bool")
+                return "bool"
+            elif expr.op in ("lt", "le", "gt", "ge", "add", "sub", "mul", "div"):
+                lhs_type = self.get_type(expr.lhs)
+                if not is_num_type(lhs_type):
+                    raise TypeError(f"Lhs of {expr.op} operator must be number")
+                rhs_type = self.get_type(expr.rhs)
+                if not is_num_type(rhs_type):
+                    raise TypeError(f"Rhs of {expr.op} operator must be number")
+                if expr.op in ("lt", "le", "gt", "ge"):
+                    return "bool"
+                elif lhs_type == "int" and rhs_type == "int":
+                    return "int"
+                else:
+                    return "float"
+            elif expr.op in ("eq", "ne"):
+                lhs_type = self.get_type(expr.lhs)
+                rhs_type = self.get_type(expr.rhs)
+                valid = lhs_type == rhs_type or (
+                    is_num_type(lhs_type) and is_num_type(rhs_type)
+                )
+                if not valid:
+                    raise TypeError(
+                        f"Lhs ({lhs_type}) and Rhs ({rhs_type}) of operator {expr.op} must be of convertible types"
+                    )
+                return "bool"
+            else:
+                raise TypeError(f"Invalid binary operand: {expr.op}")
+        elif isinstance(expr, ExprIdent):
+            var_type = self.var_types.get(expr.name)
+            assert var_type is not None, f"Variable missing in config: {expr.name}"
+            return var_type
+        elif isinstance(expr, ExprLiteral):
+            # No isinstance, because bool is a subclass of int
+            if type(expr.value) == int:
+                return "int"
+            elif type(expr.value) == float:
                 return "float"
-        elif expr.op in ("eq", "ne"):
-            lhs_type = get_expr_type(env_vars, expr.lhs)
-            rhs_type = get_expr_type(env_vars, expr.rhs)
-            valid = lhs_type == rhs_type or (
-                is_num_type(lhs_type) and is_num_type(rhs_type)
-            )
-            if not valid:
+            elif type(expr.value) == bool:
+                return "bool"
+            elif type(expr.value) == str:
+                return "string"
+            else:
+                raise TypeError("Invalid literal type")
+        elif isinstance(expr, ExprAssign):
+            var_type = self.var_types.get(expr.name)
+            assert var_type is not None
+            rhs_type = self.get_type(expr.value)
+            if rhs_type != var_type:
                 raise TypeError(
-                    f"Lhs ({lhs_type}) and Rhs ({rhs_type}) of operator {expr.op} must be of convertible types"
+                    f"Lhs ({var_type}) and Rhs ({rhs_type}) of assignment must be of the same type"
                 )
-            return "bool"
-        else:
-            raise TypeError(f"Invalid binary operand: {expr.op}")
-    elif isinstance(expr, ExprIdent):
-        var = find_env_var(env_vars, expr.name)
-        assert var is not None, f"Variable missing in config: {expr.name}"
-        return var["type"]
-    elif isinstance(expr, ExprLiteral):
-        # No isinstance, because bool is a subclass of int
-        if type(expr.value) == int:
-            return "int"
-        elif type(expr.value) == float:
-            return "float"
-        elif type(expr.value) == bool:
-            return "bool"
-        elif type(expr.value) == str:
-            return "string"
-        else:
-            raise TypeError("Invalid literal type")
-    elif isinstance(expr, ExprAssign):
-        var = find_env_var(env_vars, expr.name)
-        assert var is not None
-        rhs_type = get_expr_type(env_vars, expr.value)
-        if rhs_type != var["type"]:
-            raise TypeError(
-                f"Lhs ({var['type']}) and Rhs ({rhs_type}) of assignment must be of the same type"
+            return "assign"
+
+
+@register_rule
+class ExprTypes(Rule):
+    name = "expr-types"
+
+    @classmethod
+    def applies_to(cls, env):
+        return env.variables is not None
+
+    def __init__(self, linter):
+        super().__init__(linter)
+        self.type_checker = ExprTypeChecker(linter.env)
+
+    def check_expr_type(self, path, code, expected_type, message):
+        try:
+            if self.type_checker.get_type(code.ast) != expected_type:
+                self.report("error", path, code.loc, message)
+        except TypeError as exc:
+            self.report("error", path, code.loc, str(exc))
+
+    def on_node(self, path, cfg, node):
+        if isinstance(node, ChoiceNode):
+            for opt in node.options:
+                if opt.cond:
+                    self.check_expr_type(
+                        path, opt.cond, "bool", "Expression must be bool"
+                    )
+        elif isinstance(node, IfNode):
+            self.check_expr_type(path, node.cond, "bool", "Expression must be bool")
+        elif isinstance(node, RunNode):
+            self.check_expr_type(
+                path, node.code, "assign", "Expression must be assignment"
             )
-        return "assign"
-
 
-# TODO: Error locations are very bad here. Improve this somehow
-def lint_expr_types(ctx, config, sources):
-    if "environment" not in config:
-        return
-    if "variables" not in config["environment"]:
-        return
-    env_vars = config["environment"]["variables"]
 
-    for path, sections in sources.items():
-        for section in sections:
-            for node in section.nodes:
-                node_loc = FileLocation(path, node.meta.loc)
-                try:
-                    if isinstance(node, ChoiceNode):
-                        for opt in node.options:
-                            if opt.cond:
-                                if get_expr_type(env_vars, opt.cond.ast) != "bool":
-                                    ctx.messages.append(
-                                        Message(
-                                            "error",
-                                            node_loc,
-                                            f"Expression must be bool",
-                                        )
-                                    )
-                    elif isinstance(node, IfNode):
-                        if get_expr_type(env_vars, node.cond.ast) != "bool":
-                            ctx.messages.append(
-                                Message("error", node_loc, f"Expression must be bool")
-                            )
-                    elif isinstance(node, RunNode):
-                        if get_expr_type(env_vars, node.code.ast) != "assign":
-                            ctx.messages.append(
-                                Message(
-                                    "error", node_loc, f"Expression must be assignment"
-                                )
-                            )
-                except TypeError as exc:
-                    ctx.messages.append(Message("error", node_loc, str(exc)))
+class TimedHook:
+    """Wraps a rule hook and adds up the time spent in it (see Linter.timings)."""
+
+    def __init__(self, timings: dict[str, float], name: str, hook):
+        self.timings = timings
+        self.name = name
+        self.hook = hook
+
+    def __call__(self, *args):
+        start = time.perf_counter()
+        self.hook(*args)
+        self.timings[self.name] += time.perf_counter() - start
+
+
+class Linter:
+    """Lints sections one at a time, so callers can stream sections through it
+    without keeping all of them in memory.
+
+    Every section is walked once and its nodes and dialog lines are passed to all
+    enabled rules (see Rule). Rules can be disabled in the config with
+    `lint: {rules: {<rule name>: false}}`. If `timings` is set, the time spent in
+    every rule is added up in `self.timings`.
+    """
+
+    def __init__(self, ctx, config, timings=False, env: Environment | None = None):
+        self.ctx = ctx
+        self.config = config
+        self.env = env if env is not None else Environment(config)
+        enabled = config.get("lint", {}).get("rules", {})
+        for name in enabled:
+            if name not in RULES:
+                sys.exit(f"Unknown lint rule in config: {name}")
+
+        self.rules: dict[str, Rule] = {}
+        for name, rule in RULES.items():
+            if enabled.get(name, True) and rule.applies_to(self.env):
+                self.rules[name] = rule(self)
+
+        self.timings: dict[str, float] | None = None
+        if timings:
+            self.timings = {name: 0.0 for name in self.rules}
+
+        self.section_hooks = self.get_hooks("on_section")
+        self.node_hooks = self.get_hooks("on_node")
+        self.line_hooks = self.get_hooks("on_line")
+        self.finish_hooks = self.get_hooks("finish")
+
+    def get_hooks(self, hook_name: str) -> list:
+        hooks = []
+        for name, rule in self.rules.items():
+            # Skip rules that don't override the hook, so they cost nothing
+            if getattr(type(rule), hook_name) is getattr(Rule, hook_name):
+                continue
+            hook = getattr(rule, hook_name)
+            if self.timings is not None:
+                hook = TimedHook(self.timings, name, hook)
+            hooks.append(hook)
+        return hooks
+
+    def lint_section(self, path: str, section: Section) -> ControlFlowGraph:
+        """Returns the control flow graph of the section, for callers that need it
+        as well.
+        """
+        cfg = ControlFlowGraph(NodeIndex(section))
+        for hook in self.section_hooks:
+            hook(path, cfg)
+
+        node_hooks = self.node_hooks
+        line_hooks = self.line_hooks
+        for node in section.nodes:
+            for hook in node_hooks:
+                hook(path, cfg, node)
+            if line_hooks:
+                if isinstance(node, SayNode):
+                    for hook in line_hooks:
+                        hook(path, node.line)
+                elif isinstance(node, ChoiceNode):
+                    for opt in node.options:
+                        for hook in line_hooks:
+                            hook(path, opt.line)
+        return cfg
+
+    def get_facts(self, path: str) -> dict:
+        """Returns what the cross-file rules need to know about the sections of path
+        (see Rule.get_facts).
+        """
+        facts = {}
+        for name, rule in self.rules.items():
+            rule_facts = rule.get_facts(path)
+            if rule_facts is not None:
+                facts[name] = rule_facts
+        return facts
+
+    def add_facts(self, path: str, facts: dict):
+        """Adds facts returned by get_facts, instead of linting the sections of path
+        again.
+        """
+        for name, rule_facts in facts.items():
+            if name in self.rules:
+                self.rules[name].add_facts(path, rule_facts)
+
+    def remove_facts(self, path: str):
+        for rule in self.rules.values():
+            rule.remove_facts(path)
+
+    def finish(self):
+        for hook in self.finish_hooks:
+            hook()
+
+
+def print_timings(timings: dict[str, float]):
+    for name, seconds in sorted(timings.items(), key=lambda t: t[1], reverse=True):
+        print(f"{name:>24}: {seconds * 1000:8.2f} ms", file=sys.stderr)
 
 
 def fix_add_line_ids(sources):
     pass
 
 
-def lint(ctx, config, sources, fixes=[]):
-    lint_unique_section_names(ctx, config, sources)
-    lint_unique_ids(ctx, config, sources)
-    lint_valid_node_ids(ctx, config, sources)
-    lint_valid_speaker_id(ctx, config, sources)
-    lint_unreachable_nodes(ctx, config, sources)
-    # lint_goto_after_say(ctx, config, sources) # warn
-    lint_valid_interpolations(ctx, config, sources)
-    lint_markup_nesting(ctx, config, sources)
-    lint_known_markup(ctx, config, sources)
-    lint_expr_types(ctx, config, sources)
+def lint(ctx, config, sources, fixes=[], timings=False):
+    linter = Linter(ctx, config, timings)
+    for path, sections in sources.items():
+        # Files with syntax errors have already been reported
+        if sections is None:
+            continue
+        for section in sections:
+            linter.lint_section(path, section)
+    linter.finish()
 
     if "add-line-ids" in fixes:
         fix_add_line_ids(sources)
 
+    return linter
 
-def lint_files(args, config, files):
-    config = {}
-    if args.config:
-        config = load_config(args.config)
 
+def find_dgml_files(inputs: list[str], pattern: str) -> list[str]:
+    """Expands the directories in inputs to the files in them that match the glob
+    pattern. Other inputs are taken as they are.
+    """
+    files = []
+    for input in inputs:
+        if os.path.isdir(input):
+            files.extend(sorted(str(p) for p in Path(input).glob(pattern)))
+        else:
+            files.append(input)
+    return files
+
+
+def map_files(jobs: int, fn, files: list[str]):
+    """Calls fn for every file, in a pool of `jobs` processes if there is more than
+    one job (0 for one per CPU). The results are returned in the order of files,
+    whichever finishes first.
+    """
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    if jobs == 1 or len(files) <= 1:
+        yield from map(fn, files)
+        return
+    with ProcessPoolExecutor(min(jobs, len(files))) as executor:
+        yield from executor.map(fn, files)
+
+
+@dataclass
+class LintedFile:
+    """The result of lint_file. sections is only set if it was asked for and the
+    file had to be parsed.
+    """
+
+    messages: list[Message]
+    # None if the file has syntax errors
+    facts: dict | None
+    sections: list[Section] | None
+    timings: dict[str, float] | None
+
+
+def lint_file(
+    source_path: str,
+    config,
+    cache_dir: str | None = None,
+    timings: bool = False,
+    keep_sections: bool = False,
+) -> LintedFile:
+    """Parses and lints a single file, without the cross-file rules. It is called in
+    the worker processes of lint_files, so everything has to be passed explicitly.
+    """
     ctx = ErrorContext([])
+    cache = ParseCache(cache_dir) if cache_dir else None
+    lint_cache = LintCache(cache_dir) if cache_dir else None
+    config_hash = hash_config(config)
+
+    with open(source_path) as f:
+        source = f.read()
+    source_hash = hash_source(source)
+
+    # Unchanged files are not linted again, but their facts are still needed for the
+    # cross-file rules
+    if lint_cache is not None:
+        result = lint_cache.load(source_path, source_hash, config_hash)
+        if result is not None:
+            return LintedFile(result.messages, result.facts, None, None)
+
+    sections = parse_dgml_cached(ctx, cache, source_path, source, source_hash)
+    # Files with syntax errors are only reported
+    if sections is None:
+        return LintedFile(ctx.messages, None, None, None)
+
+    first_message = len(ctx.messages)
+    linter = Linter(ctx, config, timings)
+    for section in sections:
+        linter.lint_section(source_path, section)
+    facts = linter.get_facts(source_path)
+    if lint_cache is not None:
+        result = LintResult(ctx.messages[first_message:], facts)
+        lint_cache.store(source_path, source_hash, config_hash, result)
+
+    return LintedFile(
+        ctx.messages, facts, sections if keep_sections else None, linter.timings
+    )
 
+
+def lint_files(args, config, files):
+    ctx = ErrorContext([])
+    linter = Linter(ctx, config, args.timings)
+
+    lint_one = functools.partial(
+        lint_file,
+        config=config,
+        cache_dir=args.cache_dir,
+        timings=args.timings,
+        keep_sections="add-line-ids" in args.fix,
+    )
     sources = {}
-    for source_path in files:
-        with open(source_path) as f:
-            source = f.read()
-        sources[source_path] = parse_dgml(ctx, source_path, source)
+    for source_path, linted in zip(files, map_files(args.jobs, lint_one, files)):
+        ctx.messages.extend(linted.messages)
+        if linted.facts is not None:
+            linter.add_facts(source_path, linted.facts)
+        if linted.sections is not None:
+            sources[source_path] = linted.sections
+        if linted.timings is not None:
+            for name, seconds in linted.timings.items():
+                linter.timings[name] += seconds
+
+    # The cross-file rules run once, on the facts of all files
+    linter.finish()
+
+    if "add-line-ids" in args.fix:
+        fix_add_line_ids(sources)
 
-    lint(ctx, config, sources, args.fix)
+    report(args, ctx, linter)
+    if len(ctx.messages) > 0:
+        sys.exit(1)
 
-    print_errors(ctx)
 
-    if len(ctx.messages) > 0:
-        if not args.watch:
-            sys.exit(1)
-    elif not args.quiet:
+def report(args, ctx, linter):
+    print_errors(ctx)
+    if args.timings:
+        print_timings(linter.timings)
+    if len(ctx.messages) == 0 and not args.quiet:
         print("No warnings or errors", file=sys.stderr)
 
 
-def rectify_path(path: str, rectified: list[str]):
-    for r in rectified:
-        if Path(path).samefile(r):
-            return r
-    raise ValueError(f"Cannot match path: {path}")
+@dataclass
+class ProjectFile:
+    parser: IncrementalParser
+    source_hash: str | None = None
+    # None if the file has syntax errors
+    sections: list[Section] | None = None
+    parse_messages: list[Message] = field(default_factory=list)
+    # None if the file has to be linted again
+    result: LintResult | None = None
+    # id(section) -> (section, first line, result) of the last lint
+    section_results: dict[int, tuple[Section, int, LintResult]] = field(
+        default_factory=dict
+    )
+
+
+class Project:
+    """Keeps the parsed sections and lint results of all files of a project in
+    memory, for `lint --watch` and the language server.
+
+    The inputs can be files or directories, directories are searched for files that
+    match the glob pattern (also for files that are created later). After files
+    changed, only those are read and parsed again (see IncrementalParser), and only
+    their sections that changed or moved are linted again. Every other section and
+    file only contributes its stored messages and facts for the cross-file rules.
+    """
+
+    def __init__(
+        self,
+        inputs: list[str],
+        pattern: str = "**/*.dgml",
+        config_path: str | None = None,
+        timings: bool = False,
+    ):
+        self.inputs = inputs
+        self.pattern = pattern
+        self.config_path = os.path.realpath(config_path) if config_path else None
+        self.timings = timings
+        self.load_config()
+        # path -> file, in the order the files are reported
+        self.files: dict[str, ProjectFile] = {}
+        # absolute path -> path, to match the paths of file change events
+        self.paths: dict[str, str] = {}
+        # path -> source, for files whose contents are not (yet) on disk
+        self.sources: dict[str, str] = {}
+        for path in find_dgml_files(self.inputs, self.pattern):
+            self.add_file(path)
+
+    def load_config(self):
+        self.config = {}
+        if self.config_path:
+            self.config = load_config(self.config_path)
+        self.env = Environment(self.config)
+        # Lints single sections (see lint_section). It is kept, so the rules are only
+        # created once and the type checker remembers the expressions it has seen.
+        self.section_linter = Linter(
+            ErrorContext([]), self.config, self.timings, self.env
+        )
 
+    def add_file(self, path: str):
+        self.files[path] = ProjectFile(IncrementalParser(path))
+        self.paths[os.path.realpath(path)] = path
+
+    def set_source(self, path: str, source: str | None) -> str:
+        """Replaces the contents of a file, e.g. with the unsaved text of an editor,
+        and adds the file if it isn't part of the project yet. With source None, the
+        file on disk is used again. Returns the project path of the file.
+        """
+        path = self.paths.get(os.path.realpath(path), path)
+        if path not in self.files:
+            self.add_file(path)
+        if source is None:
+            self.sources.pop(path, None)
+            if not os.path.isfile(path):
+                self.files.pop(path)
+                return path
+        else:
+            self.sources[path] = source
+        self.parse_file(path)
+        return path
+
+    def remove_file(self, path: str):
+        self.files.pop(path, None)
+        self.sources.pop(path, None)
+
+    def watch_paths(self) -> list[str]:
+        paths = list(self.inputs)
+        if self.config_path:
+            paths.append(self.config_path)
+        return paths
+
+    def match_path(self, abs_path: str) -> str | None:
+        """Returns the project path of a changed file, if it belongs to the project.
+
+        New files only have to be in one of the input directories and match the file
+        name part of the glob pattern.
+        """
+        if abs_path in self.paths:
+            return self.paths[abs_path]
+        if not fnmatch.fnmatch(os.path.basename(abs_path), Path(self.pattern).name):
+            return None
+        for input in self.inputs:
+            if not os.path.isdir(input):
+                continue
+            rel_path = os.path.relpath(abs_path, os.path.realpath(input))
+            if not rel_path.startswith(".."):
+                return os.path.join(input, rel_path)
+        return None
+
+    def update(self, changed_paths: set[str]) -> bool:
+        """Takes a batch of changed absolute paths and updates the files they
+        belong to. Files that no longer exist are removed from the project. Returns
+        whether any of the paths belong to the project.
+        """
+        changed_paths = {os.path.realpath(path) for path in changed_paths}
+        updated = False
+        if self.config_path in changed_paths:
+            self.load_config()
+            for file in self.files.values():
+                file.result = None
+                file.section_results = {}
+            updated = True
+
+        for abs_path in changed_paths:
+            path = self.match_path(abs_path)
+            if path is None:
+                continue
+            if path in self.sources:
+                continue
+            updated = True
+            if not os.path.isfile(path):
+                self.files.pop(path, None)
+                continue
+            if path not in self.files:
+                self.add_file(path)
+            try:
+                self.parse_file(path)
+            except FileNotFoundError:
+                # Removed again since the change, e.g. a temporary file of an editor
+                self.files.pop(path, None)
+        return updated
+
+    def parse_file(self, path: str):
+        file = self.files[path]
+        if path in self.sources:
+            source = self.sources[path]
+        else:
+            with open(path) as f:
+                source = f.read()
+        source_hash = hash_source(source)
+        # Editors often write files more than once per save
+        if source_hash == file.source_hash:
+            return
+        ctx = ErrorContext([])
+        file.source_hash = source_hash
+        file.sections = file.parser.parse(ctx, source)
+        file.parse_messages = ctx.messages
+        file.result = None
+
+    def lint(self) -> Linter:
+        """Lints the files that changed and runs the cross-file rules. The messages
+        of all files are in the context of the returned linter.
+        """
+        ctx = ErrorContext([])
+        linter = Linter(ctx, self.config, self.timings, self.env)
+        for path, file in self.files.items():
+            if file.source_hash is None:
+                self.parse_file(path)
+            ctx.messages.extend(file.parse_messages)
+            # Files with syntax errors have already been reported
+            if file.sections is None:
+                continue
+            if file.result is not None:
+                ctx.messages.extend(file.result.messages)
+                linter.add_facts(path, file.result.facts)
+                continue
 
-def main(args):
-    config = {}
-    if args.config:
-        config = load_config(args.config)
+            first_message = len(ctx.messages)
+            section_results = {}
+            for section in file.sections:
+                result = self.lint_section(linter, path, file, section)
+                section_results[id(section)] = (section, section.loc.line, result)
+                ctx.messages.extend(result.messages)
+                linter.add_facts(path, result.facts)
+            file.section_results = section_results
+            file.result = LintResult(
+                ctx.messages[first_message:], linter.get_facts(path)
+            )
+        linter.finish()
+        return linter
+
+    def lint_section(
+        self, linter: Linter, path: str, file: ProjectFile, section: Section
+    ) -> LintResult:
+        # Sections that were moved are linted again, so all locations are up to date
+        if id(section) in file.section_results:
+            cached, first_line, result = file.section_results[id(section)]
+            if cached is section and first_line == section.loc.line:
+                return result
+
+        # A linter of its own separates the facts of the section from the others
+        section_linter = self.section_linter
+        section_linter.lint_section(path, section)
+        result = LintResult(section_linter.ctx.messages, section_linter.get_facts(path))
+        section_linter.ctx.messages = []
+        section_linter.remove_facts(path)
+        if linter.timings is not None:
+            for name, seconds in section_linter.timings.items():
+                linter.timings[name] += seconds
+                section_linter.timings[name] = 0.0
+        return result
 
-    lint_files(args, config, args.input)
 
-    if args.watch:
-        files = []
-        files.extend(args.input)
+def main(args):
+    if not args.watch:
+        config = {}
         if args.config:
-            files.append(args.config)
-
-        watch_filter = lambda change, str: change == Change.modified
-        for changes in watch(*files, watch_filter=watch_filter):
-            changed_files = [rectify_path(path, files) for change, path in changes]
-            if args.config in changed_files:
-                config = load_config(args.config)
-                lint_files(args, config, args.input)
-            else:
-                lint_files(args, config, changed_files)
+            config = load_config(args.config)
+        lint_files(args, config, find_dgml_files(args.input, args.glob))
+        return
+
+    # Only import watchfiles when needed, it takes a while to import
+    from watchfiles import watch
+
+    project = Project(args.input, args.glob, args.config, args.timings)
+    linter = project.lint()
+    report(args, linter.ctx, linter)
+    # watchfiles waits until no more changes arrive (for up to `debounce` ms), so a
+    # burst of changes, e.g. from a git checkout, is handled as one batch
+    for changes in watch(*project.watch_paths(), debounce=args.debounce):
+        # Other files in the watched directories are ignored
+        if not project.update({path for change, path in changes}):
+            continue
+        linter = project.lint()
+        report(args, linter.ctx, linter)
@@ -0,0 +1,342 @@
+import json
+import os
+import re
+import sys
+from urllib.parse import unquote, urlparse
+from pathlib import Path
+
+from .lint import Project
+
+# JSON-RPC error codes
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+
+# LSP enums
+TEXT_DOCUMENT_SYNC_INCREMENTAL = 2
+SEVERITIES = {"error": 1, "warning": 2}
+SEVERITY_INFORMATION = 3
+COMPLETION_KIND_VARIABLE = 6
+COMPLETION_KIND_KEYWORD = 14
+COMPLETION_KIND_REFERENCE = 18
+MESSAGE_TYPE_ERROR = 1
+
+SECTION_HEADER_RE = re.compile(r"\s*\[\s*([a-zA-Z_]\w*)\s*\]")
+NODE_ID_DEF_RE = re.compile(r"\s*@([a-zA-Z_]\w*)")
+WORD_RE = re.compile(r"[a-zA-Z_][\w.]*")
+
+
+def uri_to_path(uri: str) -> str:
+    return unquote(urlparse(uri).path)
+
+
+def path_to_uri(path: str) -> str:
+    return Path(os.path.abspath(path)).as_uri()
+
+
+def utf16_offset(line: str, character: int) -> int:
+    """Converts an LSP character offset (in UTF-16 code units) to an index into line."""
+    units = 0
+    for i, c in enumerate(line):
+        if units >= character:
+            return i
+        units += 2 if ord(c) > 0xFFFF else 1
+    return len(line)
+
+
+def utf16_length(text: str) -> int:
+    return sum(2 if ord(c) > 0xFFFF else 1 for c in text)
+
+
+class Document:
+    """The text of a document opened in the editor, kept in lines so that edits only
+    touch the lines they change.
+    """
+
+    def __init__(self, text: str):
+        self.lines = text.split("\n")
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+    def apply_change(self, change: dict):
+        if "range" not in change:
+            self.lines = change["text"].split("\n")
+            return
+        start = change["range"]["start"]
+        end = change["range"]["end"]
+        start_line = (
+            self.lines[start["line"]] if start["line"] < len(self.lines) else ""
+        )
+        end_line = self.lines[end["line"]] if end["line"] < len(self.lines) else ""
+        before = start_line[: utf16_offset(start_line, start["character"])]
+        after = end_line[utf16_offset(end_line, end["character"]) :]
+        new_lines = (before + change["text"] + after).split("\n")
+        self.lines[start["line"] : end["line"] + 1] = new_lines
+
+    def section_lines(self, line: int) -> range:
+        """Returns the lines of the section that contains line."""
+        start = line
+        while start > 0 and not SECTION_HEADER_RE.match(self.lines[start]):
+            start -= 1
+        end = line + 1
+        while end < len(self.lines) and not SECTION_HEADER_RE.match(self.lines[end]):
+            end += 1
+        return range(start, end)
+
+    def node_ids(self, line: int) -> dict[str, int]:
+        """Returns the node ids defined in the section around line, with the line
+        they are defined in.
+        """
+        ids = {}
+        for i in self.section_lines(line):
+            m = NODE_ID_DEF_RE.match(self.lines[i])
+            if m and m.group(1) not in ids:
+                ids[m.group(1)] = i
+        return ids
+
+
+class LanguageServer:
+    """A language server for DGML files, speaking JSON-RPC on stdin and stdout.
+
+    The open documents and every DGML file of the workspace are kept in a Project,
+    so after an edit only the changed sections are parsed and linted again before
+    the diagnostics are published. Go to definition and completion work on the text
+    of the document, so they also work while the section has syntax errors.
+    """
+
+    def __init__(self, args, input=sys.stdin.buffer, output=sys.stdout.buffer):
+        self.args = args
+        self.input = input
+        self.output = output
+        self.project: Project | None = None
+        # uri -> document, for the documents open in the editor
+        self.documents: dict[str, Document] = {}
+        # uri -> project path
+        self.paths: dict[str, str] = {}
+        # Files that only belong to the project while they are open
+        self.opened_files: set[str] = set()
+        # Files that diagnostics were published for last time
+        self.diagnosed_files: set[str] = set()
+        self.shutdown = False
+
+        self.requests = {
+            "initialize": self.initialize,
+            "shutdown": self.on_shutdown,
+            "textDocument/definition": self.definition,
+            "textDocument/completion": self.completion,
+        }
+        self.notifications = {
+            "initialized": self.initialized,
+            "exit": self.on_exit,
+            "textDocument/didOpen": self.did_open,
+            "textDocument/didChange": self.did_change,
+            "textDocument/didClose": self.did_close,
+            "textDocument/didSave": self.did_save,
+        }
+
+    def read_message(self) -> dict | None:
+        length = None
+        while True:
+            header = self.input.readline()
+            if not header:
+                return None
+            header = header.decode("ascii").strip()
+            if header == "":
+                break
+            name, value = header.split(":", 1)
+            if name.lower() == "content-length":
+                length = int(value)
+        return json.loads(self.input.read(length).decode("utf-8"))
+
+    def send_message(self, message: dict):
+        message["jsonrpc"] = "2.0"
+        body = json.dumps(message).encode("utf-8")
+        self.output.write(f"Content-Length: {len(body)}\r\n\r\n".encode("ascii"))
+        self.output.write(body)
+        self.output.flush()
+
+    def notify(self, method: str, params):
+        self.send_message({"method": method, "params": params})
+
+    def run(self):
+        while True:
+            message = self.read_message()
+            if message is None:
+                sys.exit(0 if self.shutdown else 1)
+            self.handle_message(message)
+
+    def handle_message(self, message: dict):
+        method = message.get("method")
+        params = message.get("params", {})
+        if "id" not in message:
+            # Unknown notifications (e.g. $/cancelRequest) are ignored
+            if method not in self.notifications:
+                return
+            try:
+                self.notifications[method](params)
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                # Notifications have no response, so the error can only be logged,
+                # but the session goes on
+                self.notify(
+                    "window/logMessage",
+                    {"type": MESSAGE_TYPE_ERROR, "message": f"{method} failed: {e!r}"},
+                )
+            return
+
+        if method not in self.requests:
+            error = {"code": METHOD_NOT_FOUND, "message": f"Unknown method: {method}"}
+            self.send_message({"id": message["id"], "error": error})
+            return
+        try:
+            result = self.requests[method](params)
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            error = {"code": INVALID_PARAMS, "message": f"Invalid params: {e}"}
+            self.send_message({"id": message["id"], "error": error})
+            return
+        self.send_message({"id": message["id"], "result": result})
+
+    # Lifecycle
+
+    def initialize(self, params):
+        inputs = []
+        root_uri = params.get("rootUri")
+        if root_uri:
+            inputs.append(uri_to_path(root_uri))
+        self.project = Project(inputs, self.args.glob, self.args.config)
+        return {
+            "capabilities": {
+                "textDocumentSync": {
+                    "openClose": True,
+                    "change": TEXT_DOCUMENT_SYNC_INCREMENTAL,
+                    "save": True,
+                },
+                "definitionProvider": True,
+                "completionProvider": {"triggerCharacters": ["@", "{", "[", "/"]},
+            },
+            "serverInfo": {"name": "dgml"},
+        }
+
+    def initialized(self, params):
+        # Notifications may only be sent after the response to initialize
+        self.publish_diagnostics()
+
+    def on_shutdown(self, params):
+        self.shutdown = True
+        return None
+
+    def on_exit(self, params):
+        sys.exit(0 if self.shutdown else 1)
+
+    # Document sync
+
+    def did_open(self, params):
+        doc = params["textDocument"]
+        path = uri_to_path(doc["uri"])
+        if self.project.paths.get(os.path.realpath(path)) not in self.project.files:
+            self.opened_files.add(os.path.realpath(path))
+        self.documents[doc["uri"]] = Document(doc["text"])
+        self.paths[doc["uri"]] = self.project.set_source(path, doc["text"])
+        self.publish_diagnostics()
+
+    def did_change(self, params):
+        uri = params["textDocument"]["uri"]
+        document = self.documents[uri]
+        for change in params["contentChanges"]:
+            document.apply_change(change)
+        self.project.set_source(self.paths[uri], document.text)
+        self.publish_diagnostics()
+
+    def did_save(self, params):
+        # The document is in sync already, but other files might depend on it
+        pass
+
+    def did_close(self, params):
+        uri = params["textDocument"]["uri"]
+        path = self.paths.pop(uri)
+        del self.documents[uri]
+        if os.path.realpath(path) in self.opened_files:
+            self.opened_files.discard(os.path.realpath(path))
+            self.project.remove_file(path)
+        else:
+            self.project.set_source(path, None)
+        self.publish_diagnostics()
+
+    def publish_diagnostics(self):
+        diagnostics = {path: [] for path in self.diagnosed_files}
+        for msg in self.project.lint().ctx.messages:
+            line = max(msg.loc.src_loc.line - 1, 0)
+            column = max(msg.loc.src_loc.column - 1, 0)
+            position = {"line": line, "character": column}
+            diagnostics.setdefault(msg.loc.file, []).append(
+                {
+                    "range": {"start": position, "end": position},
+                    "severity": SEVERITIES.get(msg.type, SEVERITY_INFORMATION),
+                    "source": "dgml",
+                    "message": msg.message,
+                }
+            )
+        for path, file_diagnostics in diagnostics.items():
+            self.notify(
+                "textDocument/publishDiagnostics",
+                {"uri": path_to_uri(path), "diagnostics": file_diagnostics},
+            )
+        self.diagnosed_files = {path for path, d in diagnostics.items() if d}
+
+    # Language features
+
+    def definition(self, params):
+        uri = params["textDocument"]["uri"]
+        document = self.documents[uri]
+        line = params["position"]["line"]
+        text = document.lines[line]
+        column = utf16_offset(text, params["position"]["character"])
+        for m in WORD_RE.finditer(text):
+            # Only node ids (with their @) can be followed
+            if (
+                m.start() <= column <= m.end()
+                and text[m.start() - 1 : m.start()] == "@"
+            ):
+                node_ids = document.node_ids(line)
+                if m.group() not in node_ids:
+                    return None
+                def_line = node_ids[m.group()]
+                start = document.lines[def_line].index("@")
+                return {
+                    "uri": uri,
+                    "range": {
+                        "start": {"line": def_line, "character": start},
+                        "end": {
+                            "line": def_line,
+                            "character": start + 1 + utf16_length(m.group()),
+                        },
+                    },
+                }
+        return None
+
+    def completion(self, params):
+        document = self.documents[params["textDocument"]["uri"]]
+        line = params["position"]["line"]
+        text = document.lines[line]
+        before = text[: utf16_offset(text, params["position"]["character"])]
+        env = self.project.env
+
+        # Drop the word that is being typed, the editor filters by it
+        prefix = before[: len(before) - len(re.search(r"[\w.]*$", before).group())]
+        in_string = len(re.findall(r'(?<!\\)"', prefix)) % 2 == 1
+        in_code = not in_string and prefix.count("|") % 2 == 1
+
+        if in_string and re.search(r"\[/?$", prefix):
+            names, kind = env.markup or {}, COMPLETION_KIND_KEYWORD
+        elif (in_string and prefix.endswith("{")) or in_code:
+            names, kind = env.variables or {}, COMPLETION_KIND_VARIABLE
+        elif not in_string and prefix.endswith("@"):
+            names = [*document.node_ids(line), "end"]
+            kind = COMPLETION_KIND_REFERENCE
+        else:
+            return []
+        return [{"label": name, "kind": kind} for name in sorted(names)]
+
+
+def main(args):
+    LanguageServer(args).run()
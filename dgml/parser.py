@@ -1,50 +1,57 @@
 from __future__ import annotations
 
+import os
+import re
 import sys
-from dataclasses import dataclass
+import weakref
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, fields
+from pathlib import Path
 
-from lark import Lark, Transformer, Tree, Token, v_args, exceptions
+from lark import Lark, Transformer, v_args, exceptions
 
 from .colors import *
 
 
-@dataclass
+@dataclass(slots=True)
 class SourceLoc:
     line: int = 0
     column: int = 0
 
 
-def loc_from_meta(node):
-    return SourceLoc(node.meta.line, node.meta.column)
-
-
-@dataclass
+@dataclass(slots=True)
 class NodeMeta:
     node_id: str | None
-    tags: list
+    tags: tuple[str, ...]
     loc: SourceLoc
+    # Whether the node id was generated (see generate_node_ids)
+    generated: bool = False
 
 
 # Text
+#
+# The AST classes use __slots__ and the strings that repeat a lot (speaker ids, tags,
+# node ids, section, markup and variable names) are interned by the parser, so that
+# whole projects can be kept in memory.
 
 
-@dataclass
+@dataclass(slots=True)
 class LiteralFragment:
     text: str
 
 
-@dataclass
+@dataclass(slots=True)
 class VariableFragment:
     variable_name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class TagOpen:
     name: str
     parameter: str | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class TagClose:
     name: str
 
@@ -52,7 +59,7 @@ class TagClose:
 LineFragment = LiteralFragment | VariableFragment | TagOpen | TagClose
 
 
-@dataclass
+@dataclass(slots=True)
 class DialogLine:
     text: list[LineFragment]
     raw_text: str
@@ -61,82 +68,117 @@ class DialogLine:
 
 
 # Expressions
+#
+# Expression nodes are hash-consed: they are immutable and only created through
+# make_expr, which returns the same object for structurally identical expressions.
+# Therefore identity is equality and they can be used as dictionary keys cheaply
+# (e.g. to memoize type checking), no matter how often an expression occurs.
 
 
-@dataclass
-class ExprUnary:
+class HashConsedExpr:
+    # The table of make_expr only keeps weak references
+    __slots__ = ("__weakref__",)
+
+    def __reduce__(self):
+        # Unpickled expressions (e.g. from the parse cache) are hash-consed as well
+        return (make_expr, (type(self), *(getattr(self, f.name) for f in fields(self))))
+
+
+@dataclass(frozen=True, eq=False, slots=True)
+class ExprUnary(HashConsedExpr):
     op: str  # not
     rhs: "ExprNode"
 
 
-@dataclass
-class ExprBinary:
+@dataclass(frozen=True, eq=False, slots=True)
+class ExprBinary(HashConsedExpr):
     op: str  # or, and, add, sub, mul, div, lt, le, eq, ne, gt, ge
     lhs: "ExprNode"
     rhs: "ExprNode"
 
 
-@dataclass
-class ExprIdent:
+@dataclass(frozen=True, eq=False, slots=True)
+class ExprIdent(HashConsedExpr):
     name: str
 
 
-@dataclass
-class ExprLiteral:
+@dataclass(frozen=True, eq=False, slots=True)
+class ExprLiteral(HashConsedExpr):
     value: bool | int | float | str
 
 
-@dataclass
-class ExprAssign:
+@dataclass(frozen=True, eq=False, slots=True)
+class ExprAssign(HashConsedExpr):
     name: str
     value: "ExprNode"
 
 
+# Expressions are only kept while they are in use, as long running processes (lint
+# --watch, the language server) parse again after every change
+_expr_table = weakref.WeakValueDictionary()
+
+
+def make_expr(cls, *args):
+    # Child expressions are hash-consed already, so they are hashed by identity
+    if cls is ExprLiteral:
+        # 1, 1.0 and True are equal in Python, but are different literals
+        key = (cls, type(args[0]), args[0])
+    else:
+        key = (cls, *args)
+    expr = _expr_table.get(key)
+    if expr is None:
+        expr = cls(*args)
+        _expr_table[key] = expr
+    return expr
+
+
 # Assign is missing intentionally
 ExprNode = ExprUnary | ExprBinary | ExprIdent | ExprLiteral
 
 
-@dataclass
+@dataclass(slots=True)
 class Expression:
     ast: ExprNode
     raw: str
+    loc: SourceLoc
 
 
-@dataclass
+@dataclass(slots=True)
 class Assignment:
     ast: ExprAssign
     raw: str
+    loc: SourceLoc
 
 
 # Dialogue Nodes
 
 
-@dataclass
+@dataclass(slots=True)
 class RandNode:
     nodes: list[str]
     meta: NodeMeta
 
 
-@dataclass
+@dataclass(slots=True)
 class GotoNode:
     dest: str
     meta: NodeMeta
 
 
-@dataclass
+@dataclass(slots=True)
 class Option:
     cond: Expression | None
     line: DialogLine
     dest: str
 
 
-@dataclass
+@dataclass(slots=True)
 class ChoiceNode:
     options: list[Option]
     meta: NodeMeta
 
 
-@dataclass
+@dataclass(slots=True)
 class IfNode:
     cond: Expression
     true_dest: str
@@ -144,13 +186,13 @@ class IfNode:
     meta: NodeMeta
 
 
-@dataclass
+@dataclass(slots=True)
 class RunNode:
     code: Assignment
     meta: NodeMeta
 
 
-@dataclass
+@dataclass(slots=True)
 class SayNode:
     speaker_id: str
     line: DialogLine
@@ -161,53 +203,39 @@ class SayNode:
 Node = RandNode | GotoNode | ChoiceNode | IfNode | RunNode | SayNode
 
 
-@dataclass
+@dataclass(slots=True)
 class Section:
     name: str
     nodes: list[Node]
     loc: SourceLoc
 
 
-def get_dgml_parser():
-    if not hasattr(get_dgml_parser, "_parser"):
-        parser = Lark.open(
-            "dgml.lark",
-            rel_to=__file__,
-            parser="lalr",
-            propagate_positions=True,
-        )
-        setattr(get_dgml_parser, "_parser", parser)
-    return getattr(get_dgml_parser, "_parser")
-
-
-def get_expr_parser():
-    if not hasattr(get_expr_parser, "_parser"):
-        parser = Lark.open(
-            "expressions.lark",
-            rel_to=__file__,
-            parser="lalr",
-            propagate_positions=True,
-            maybe_placeholders=False,
-        )
-        setattr(get_expr_parser, "_parser", parser)
-    return getattr(get_expr_parser, "_parser")
-
-
-def is_tree(node, tree_data):
-    return isinstance(node, Tree) and node.data == tree_data
-
-
-def is_token(node, token_type):
-    return isinstance(node, Token) and node.type == token_type
-
-
-def lark_print(node, depth=0):
-    if isinstance(node, Token):
-        print(depth * "  " + f"{node.type}: {node.value}")
-    elif isinstance(node, Tree):
-        print(depth * "  " + f"{node.data}")
-        for child in node.children:
-            lark_print(child, depth + 1)
+def get_user_cache_dir() -> Path | None:
+    # DGML_CACHE_DIR can point all processes (e.g. build farm workers) to a shared
+    # directory. Setting it to an empty string disables the cache.
+    if "DGML_CACHE_DIR" in os.environ:
+        cache_dir = os.environ["DGML_CACHE_DIR"]
+        return Path(cache_dir) if cache_dir else None
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return Path(base) / "dgml"
+
+
+def get_parser_tables_path(grammar: str) -> str | bool:
+    """Returns the value for Lark's `cache` option.
+    Lark stores the serialized LALR tables in this file, together with a hash of the
+    grammar, the parser options and the Lark and Python versions. If any of those change,
+    the tables are rebuilt and the file is overwritten.
+    """
+    cache_dir = get_user_cache_dir()
+    if cache_dir is None:
+        return False
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return False
+    return str(cache_dir / f"{grammar}.tables")
 
 
 compare_map = {
@@ -220,298 +248,292 @@ compare_map = {
 }
 
 
-def process_expr(node) -> ExprNode:
-    if is_tree(node, "or_op"):
-        return ExprBinary(
-            "or",
-            process_expr(node.children[0]),
-            process_expr(node.children[1]),
-        )
-    elif is_tree(node, "and_op"):
-        return ExprBinary(
-            "and",
-            process_expr(node.children[0]),
-            process_expr(node.children[1]),
-        )
-    elif is_tree(node, "not_op"):
-        return ExprUnary(
-            "not",
-            process_expr(node.children[0]),
-        )
-    elif is_tree(node, "compare"):
-        return ExprBinary(
-            compare_map[node.children[1].value],
-            process_expr(node.children[0]),
-            process_expr(node.children[2]),
-        )
-    elif is_tree(node, "add"):
-        return ExprBinary(
-            "add",
-            process_expr(node.children[0]),
-            process_expr(node.children[1]),
-        )
-    elif is_tree(node, "sub"):
-        return ExprBinary(
-            "sub",
-            process_expr(node.children[0]),
-            process_expr(node.children[1]),
-        )
-    elif is_tree(node, "mul"):
-        return ExprBinary(
-            "mul",
-            process_expr(node.children[0]),
-            process_expr(node.children[1]),
-        )
-    elif is_tree(node, "div"):
-        return ExprBinary(
-            "div",
-            process_expr(node.children[0]),
-            process_expr(node.children[1]),
-        )
-    elif is_tree(node, "int_literal"):
-        return ExprLiteral(int(node.children[0].value))
-    elif is_tree(node, "float_literal"):
-        return ExprLiteral(float(node.children[0].value))
-    elif is_tree(node, "string_literal"):
-        return ExprLiteral(node.children[0].value[1:-1])
-    elif is_tree(node, "bool_literal"):
-        return ExprLiteral(node.children[0].value == "true")
-    elif is_tree(node, "paren"):
-        return process_expr(node.children[0])
-    elif is_tree(node, "ident"):
-        return ExprIdent(node.children[0].value)
-    else:
-        raise AssertionError(f"Invalid expr: {node}")
+@v_args(inline=True)
+class ExprTransformer(Transformer):
+    """Builds the expression AST directly while parsing (it is passed to Lark as the
+    transformer of the LALR parser), so no intermediate parse tree is created.
+    """
 
+    def or_op(self, lhs, rhs):
+        return make_expr(ExprBinary, "or", lhs, rhs)
 
-def parse_expr(expr) -> Expression:
-    parser = get_expr_parser()
-    tree = parser.parse(expr)
-    return Expression(process_expr(tree), expr)
+    def and_op(self, lhs, rhs):
+        return make_expr(ExprBinary, "and", lhs, rhs)
 
+    def not_op(self, rhs):
+        return make_expr(ExprUnary, "not", rhs)
 
-def process_assignment(node) -> ExprAssign:
-    if not is_tree(node, "assign"):
-        raise ValueError("Expression must be assignment")
-    return ExprAssign(node.children[0].value, process_expr(node.children[1]))
+    def compare(self, lhs, op, rhs):
+        return make_expr(ExprBinary, compare_map[op.value], lhs, rhs)
 
+    def add(self, lhs, rhs):
+        return make_expr(ExprBinary, "add", lhs, rhs)
 
-def parse_assignment(assign_str) -> Assignment:
-    parser = get_expr_parser()
-    tree = parser.parse(assign_str)
-    return Assignment(process_assignment(tree), assign_str)
+    def sub(self, lhs, rhs):
+        return make_expr(ExprBinary, "sub", lhs, rhs)
 
+    def mul(self, lhs, rhs):
+        return make_expr(ExprBinary, "mul", lhs, rhs)
 
-def add_text(fragments, text):
-    if len(fragments) == 0 or not isinstance(fragments[-1], LiteralFragment):
-        fragments.append(LiteralFragment(text))
-    else:
-        fragments[-1].text += text
+    def div(self, lhs, rhs):
+        return make_expr(ExprBinary, "div", lhs, rhs)
+
+    def int_literal(self, token):
+        return make_expr(ExprLiteral, int(token.value))
+
+    def float_literal(self, token):
+        return make_expr(ExprLiteral, float(token.value))
+
+    def string_literal(self, token):
+        return make_expr(ExprLiteral, token.value[1:-1])
+
+    def bool_literal(self, token):
+        return make_expr(ExprLiteral, token.value == "true")
+
+    def paren(self, expr):
+        return expr
+
+    def ident(self, token):
+        return make_expr(ExprIdent, sys.intern(token.value))
+
+    def assign(self, name, value):
+        return make_expr(ExprAssign, sys.intern(name.value), value)
+
+
+# Splits text into literal text (even indices) and markup (odd indices), e.g.
+# "a [b]c[/b]{d}" -> ["a ", "[b]", "c", "[/b]", "", "{d}", ""]
+TEXT_MARKUP_RE = re.compile(r"(\[\[|\{\{|\[[^\]]*\]|\{[^}]*\})")
 
 
 def parse_text(text):
+    # Fast path for the most common case: plain text without markup or variables
+    if "[" not in text and "{" not in text:
+        return [LiteralFragment(text)] if text else []
+
     fragments = []
-    i = 0
-    while i < len(text):
-        if text[i] == "[":
-            if i == len(text) - 1:
-                raise ValueError("Unmatched [")
-            if text[i + 1] == "[":
-                add_text(fragments, "[")
-                i += 2
-            else:
-                is_closing = text[i + 1] == "/"
-                closing_bracket = text.find("]", i + 1)
-                if closing_bracket == -1:
-                    raise ValueError("Unmatched [")
-                inner = text[i + 1 : closing_bracket]
-                if is_closing:
-                    fragments.append(TagClose(inner[1:]))
-                else:
-                    param_split = inner.split(":", 1)
-                    if len(param_split) == 1:
-                        fragments.append(TagOpen(inner))
-                    else:
-                        name, param = param_split
-                        fragments.append(TagOpen(name, param))
-                i = closing_bracket + 1
-        elif text[i] == "{":
-            if i == len(text) - 1:
-                raise ValueError("Unmatched [")
-            if text[i + 1] == "{":
-                add_text(fragments, "{")
-                i += 2
+    literal = []  # consecutive literal parts are joined into a single fragment
+    parts = TEXT_MARKUP_RE.split(text)
+    for i, part in enumerate(parts):
+        if i % 2 == 0:
+            # Brackets and braces in literal text are always unmatched ones
+            if "[" in part or "{" in part:
+                raise ValueError(
+                    f"Unmatched {'[' if '[' in part.split('{', 1)[0] else '{'}"
+                )
+            if part:
+                literal.append(part)
+        elif part == "[[" or part == "{{":
+            literal.append(part[0])
+        else:
+            if literal:
+                fragments.append(LiteralFragment("".join(literal)))
+                literal = []
+            if part[0] == "{":
+                fragments.append(VariableFragment(sys.intern(part[1:-1])))
+            elif part[1] == "/":
+                fragments.append(TagClose(sys.intern(part[2:-1])))
             else:
-                closing_brace = text.find("}", i + 1)
-                if closing_brace == -1:
-                    raise ValueError("Unmatched {")
-                fragments.append(VariableFragment(text[i + 1 : closing_brace]))
-                i = closing_brace + 1
-        else:  # TextFragment
-            first_bracket = text.find("[", i)
-            if first_bracket == -1:
-                first_bracket = len(text)
-            first_brace = text.find("{", i)
-            if first_brace == -1:
-                first_brace = len(text)
-            end = min(first_brace, first_bracket)
-            add_text(fragments, text[i:end])
-            i = end
+                name, sep, param = part[1:-1].partition(":")
+                fragments.append(
+                    TagOpen(sys.intern(name), sys.intern(param) if sep else None)
+                )
 
+    text = "".join(literal)
+    if text:
+        fragments.append(LiteralFragment(text))
     return fragments
 
 
-def parse_node_id(node) -> str:
-    assert is_tree(node, "node_id"), lark_print(node)
-    return node.children[0].value
+class TextError(exceptions.UnexpectedInput):
+    """An error in the markup or the variables of a dialog line (see parse_text).
+    It is raised while parsing, so it is reported like the other syntax errors.
+    """
 
+    def __init__(self, message: str, token):
+        super().__init__(message)
+        self.message = message
+        self.line = token.line
+        self.column = token.column
+        self.pos_in_stream = token.start_pos
+        self.state = None
 
-def parse_line_id(node) -> str:
-    assert is_tree(node, "line_id"), lark_print(node)
-    return node.children[0].value
+    def __str__(self):
+        return self.message
 
 
-def parse_code_block(node):
-    assert is_tree(node, "code_block"), lark_print(node)
-    return node.children[0].value
+def token_loc(token) -> SourceLoc:
+    return SourceLoc(token.line, token.column)
 
 
-def parse_dialog_line(node):
-    assert is_tree(node, "dialog_line"), lark_print(node)
-    line_id = None
-    if len(node.children) > 1:
-        line_id = parse_line_id(node.children[1])
-    raw_text = node.children[0].value[1:-1]
-    return DialogLine(
-        parse_text(raw_text),
-        raw_text,
-        line_id,
-        SourceLoc(node.meta.line, node.meta.end_column),
-    )
+# Shared location of everything parsed without positions (see DgmlTransformer)
+NO_LOC = SourceLoc(0, 0)
 
 
-def process_rand(meta, node):
-    assert is_tree(node, "rand_stmt"), lark_print(node)
-    rand = RandNode([], meta)
-    for child in node.children:
-        if is_tree(child, "node_id"):
-            rand.nodes.append(parse_node_id(child))
-    return rand
+class DgmlTransformer(ExprTransformer):
+    """Builds the DGML AST directly while parsing (see ExprTransformer).
 
+    Statement keywords are named terminals in the grammar, so they are passed to the
+    callbacks and can be used for the source location of the statement.
+    `source` must be set to the text being parsed (see parse_with_source), because
+    the raw code of code blocks is sliced from it.
 
-def process_goto(meta, node):
-    assert is_tree(node, "goto_stmt"), lark_print(node)
-    return GotoNode(parse_node_id(node.children[0]), meta)
+    If `positions` is False, all source locations are NO_LOC. This is for builds that
+    only need locations if something is wrong (see compile.main).
+    """
 
+    source = ""
+    positions = True
 
-def process_choice(meta, node):
-    assert is_tree(node, "choice_block"), lark_print(node)
-    options = []
-    for option in node.children:
-        assert is_tree(option, "choice_option"), lark_print(option)
-        if is_tree(option.children[0], "code_block"):
-            cond = parse_expr(option.children[0].children[0].value)
-            text = parse_dialog_line(option.children[1])
-            dest = parse_node_id(option.children[2])
-        else:
-            cond = None
-            text = parse_dialog_line(option.children[0])
-            dest = parse_node_id(option.children[1])
-        options.append(Option(cond, text, dest))
-    return ChoiceNode(options, meta)
-
-
-def process_if(meta, node):
-    assert is_tree(node, "if_stmt"), lark_print(node)
-    false_dest = None
-    if len(node.children) > 2:
-        false_dest = parse_node_id(node.children[2])
-    return IfNode(
-        parse_expr(node.children[0].children[0].value),
-        parse_node_id(node.children[1]),
-        false_dest,
-        meta,
-    )
+    def loc(self, token) -> SourceLoc:
+        return token_loc(token) if self.positions else NO_LOC
 
+    def start(self, sections):
+        return sections
 
-def process_run(meta, node):
-    assert is_tree(node, "run_stmt"), lark_print(node)
-    return RunNode(parse_assignment(node.children[0].children[0].value), meta)
+    def section(self, children):
+        name = children[0]
+        nodes = [node for node in children[1:] if node is not None]
+        return Section(sys.intern(name.value), nodes, self.loc(name))
 
+    def line(self, children):
+        if len(children) == 0:  # blank line
+            return None
+        node = children[-1]
+        if len(children) > 1:
+            for child in children[0]:
+                if isinstance(child, str):
+                    node.meta.node_id = child
+                else:
+                    node.meta.tags = child
+        return node
+
+    def meta(self, children):
+        return children
+
+    def tag_list(self, tags):
+        return tuple(sys.intern(tag.value) for tag in tags)
+
+    def node_id(self, children):
+        return sys.intern(children[0].value)
+
+    def line_id(self, children):
+        # The token is needed for the location of the dialog line
+        return children[0]
+
+    def get_raw_code(self, open_pipe, close_pipe) -> tuple[str, SourceLoc]:
+        code = self.source[open_pipe.end_pos : close_pipe.start_pos]
+        # Leading whitespace is skipped by the lexer and never part of the raw code
+        raw = code.lstrip(" \t")
+        if not self.positions:
+            return raw, NO_LOC
+        column = open_pipe.end_column + len(code) - len(raw)
+        return raw, SourceLoc(open_pipe.end_line, column)
+
+    def code_block(self, children):
+        raw, loc = self.get_raw_code(children[0], children[2])
+        return Expression(children[1], raw, loc)
+
+    def assign_block(self, children):
+        raw, loc = self.get_raw_code(children[0], children[2])
+        return Assignment(children[1], raw, loc)
+
+    def next_link(self, children):
+        return children[1]
+
+    def dialog_line(self, children):
+        last_token = children[-1]
+        line_id = children[1].value if len(children) > 1 else None
+        raw_text = children[0].value[1:-1]
+        try:
+            text = parse_text(raw_text)
+        except ValueError as exc:
+            raise TextError(f"{exc} in text", children[0])
+        return DialogLine(
+            text,
+            raw_text,
+            line_id,
+            (
+                SourceLoc(last_token.line, last_token.end_column)
+                if self.positions
+                else NO_LOC
+            ),
+        )
 
-def process_say(meta, node):
-    assert is_tree(node, "say_stmt"), lark_print(node)
-    next_link = None
-    if len(node.children) > 2:
-        next_link = parse_node_id(node.children[2].children[1])
-    return SayNode(
-        node.children[0].value,
-        parse_dialog_line(node.children[1]),
-        next_link,
-        meta,
-    )
+    def rand_stmt(self, children):
+        return RandNode(children[1:], NodeMeta(None, (), self.loc(children[0])))
 
+    def goto_stmt(self, children):
+        return GotoNode(children[1], NodeMeta(None, (), self.loc(children[0])))
 
-def process_statement(meta, node):
-    if is_tree(node, "rand_stmt"):
-        return process_rand(meta, node)
-    elif is_tree(node, "goto_stmt"):
-        return process_goto(meta, node)
-    elif is_tree(node, "choice_block"):
-        return process_choice(meta, node)
-    elif is_tree(node, "if_stmt"):
-        return process_if(meta, node)
-    elif is_tree(node, "run_stmt"):
-        return process_run(meta, node)
-    elif is_tree(node, "say_stmt"):
-        return process_say(meta, node)
-    else:
-        raise AssertionError(f"Invalid statement: {node}")
+    def choice_option(self, children):
+        if len(children) == 3:
+            return Option(children[0], children[1], children[2])
+        else:
+            return Option(None, children[0], children[1])
+
+    def choice_block(self, children):
+        return ChoiceNode(children[1:], NodeMeta(None, (), self.loc(children[0])))
+
+    def if_stmt(self, children):
+        false_dest = children[3] if len(children) > 3 else None
+        return IfNode(
+            children[1],
+            children[2],
+            false_dest,
+            NodeMeta(None, (), self.loc(children[0])),
+        )
 
+    def run_stmt(self, children):
+        return RunNode(children[1], NodeMeta(None, (), self.loc(children[0])))
 
-def get_meta(meta_node, statement_node):
-    assert is_tree(meta_node, "meta"), lark_print(meta_node)
-    meta = NodeMeta(None, [], loc_from_meta(statement_node))
-    for child in meta_node.children:
-        if is_tree(child, "node_id"):
-            meta.node_id = parse_node_id(child)
-        elif is_tree(child, "tag_list"):
-            meta.tags = [c.value for c in child.children]
-    return meta
+    def say_stmt(self, children):
+        next_node = children[2] if len(children) > 2 else None
+        return SayNode(
+            sys.intern(children[0].value),
+            children[1],
+            next_node,
+            NodeMeta(None, (), self.loc(children[0])),
+        )
 
 
-def process_line(node):
-    assert is_tree(node, "line"), lark_print(node)
-    if len(node.children) == 0:
-        return None
-    if is_tree(node.children[0], "meta"):
-        return process_statement(
-            get_meta(node.children[0], node.children[1]), node.children[1]
-        )
-    else:
-        return process_statement(
-            NodeMeta(None, [], loc_from_meta(node.children[0])), node.children[0]
+def get_dgml_parser():
+    if not hasattr(get_dgml_parser, "_parser"):
+        transformer = DgmlTransformer()
+        # Code blocks are parsed as part of the DGML grammar, "code" is only used to
+        # parse code outside of DGML files.
+        parser = Lark.open(
+            "dgml.lark",
+            rel_to=__file__,
+            parser="lalr",
+            start=["start", "code"],
+            transformer=transformer,
+            cache=get_parser_tables_path("dgml.lark"),
         )
+        setattr(get_dgml_parser, "_parser", parser)
+        setattr(get_dgml_parser, "_transformer", transformer)
+    return getattr(get_dgml_parser, "_parser")
 
 
-def process_section(node):
-    assert is_tree(node, "section"), lark_print(node)
-    section_name = node.children[0].value
-    nodes = []
-    for child in node.children[1:]:
-        if is_tree(child, "line"):
-            line_node = process_line(child)
-            if line_node is not None:
-                nodes.append(line_node)
-    return Section(section_name, nodes, loc_from_meta(node))
+def parse_with_source(source: str, start: str, positions: bool = True):
+    parser = get_dgml_parser()
+    transformer = getattr(get_dgml_parser, "_transformer")
+    transformer.source = source
+    transformer.positions = positions
+    return parser.parse(source, start=start)
 
 
-def process_dgml(node):
-    assert is_tree(node, "start"), lark_print(node)
-    sections = []
-    for child in node.children:
-        sections.append(process_section(child))
-    return sections
+def parse_expr(expr) -> Expression:
+    ast = parse_with_source(expr, "code")
+    if isinstance(ast, ExprAssign):
+        raise ValueError("Expression must not be an assignment")
+    return Expression(ast, expr, SourceLoc(1, 1))
+
+
+def parse_assignment(assign_str) -> Assignment:
+    ast = parse_with_source(assign_str, "code")
+    if not isinstance(ast, ExprAssign):
+        raise ValueError("Expression must be assignment")
+    return Assignment(ast, assign_str, SourceLoc(1, 1))
 
 
 def get_node_signature(section_name, node: Node):
@@ -534,10 +556,12 @@ def get_node_signature(section_name, node: Node):
         raise AssertionError("Invalid node type")
 
 
-def generate_node_ids(dgml):
+def generate_node_ids(dgml, node_sig_counts=None):
     import hashlib
 
-    node_sig_counts = {}
+    # Pass the same node_sig_counts when generating ids for consecutive parts of a file
+    if node_sig_counts is None:
+        node_sig_counts = {}
     for section in dgml:
         for node in section.nodes:
             if node.meta.node_id is None:
@@ -546,15 +570,16 @@ def generate_node_ids(dgml):
                 node.meta.node_id = hashlib.md5(
                     f"{node_sig}:{node_sig_counts[node_sig]}".encode("utf-8")
                 ).hexdigest()[:16]
+                node.meta.generated = True
 
 
-@dataclass
+@dataclass(slots=True)
 class FileLocation:
     file: str
     src_loc: SourceLoc
 
 
-@dataclass
+@dataclass(slots=True)
 class Message:
     type: str  # "error" or "warning"
     loc: FileLocation
@@ -566,27 +591,205 @@ class ErrorContext:
     messages: list
 
 
-def parse_dgml(ctx: ErrorContext, source_path: str, source: str):
-    parser = get_dgml_parser()
+def add_parse_error(
+    ctx: ErrorContext,
+    source_path: str,
+    exc: exceptions.UnexpectedInput,
+    line_offset: int = 0,
+):
+    # Lark uses -1 for errors at the end of the input
+    if line_offset != 0 and exc.line > 0:
+        exc.line += line_offset
+    ctx.messages.append(
+        Message(
+            "error",
+            FileLocation(source_path, SourceLoc(exc.line, exc.column)),
+            str(exc),
+        )
+    )
+
+
+def parse_dgml(
+    ctx: ErrorContext, source_path: str, source: str, positions: bool = True
+):
     try:
-        tree = parser.parse(source)
+        dgml = parse_with_source(source, "start", positions)
     except exceptions.UnexpectedInput as exc:
-        ctx.messages.append(
-            Message(
-                "error",
-                FileLocation(source_path, SourceLoc(exc.line, exc.column)),
-                str(exc),
-            )
-        )
+        add_parse_error(ctx, source_path, exc)
         return None
 
-    dgml = process_dgml(tree)
-
     generate_node_ids(dgml)
 
     return dgml
 
 
+# A line starting with "[" can only be a section header
+SECTION_HEADER_RE = re.compile(r"^[ \t]*\[[ \t]*([^\]\s]*)", re.MULTILINE)
+
+
+@dataclass(slots=True)
+class SectionChunk:
+    text: str
+    first_line: int  # 1-based
+    name: str
+
+
+def split_sections(source: str) -> list[SectionChunk]:
+    """Splits the source into one chunk per section at the section headers.
+    Anything before the first header is part of the first chunk.
+    """
+    starts = [(m.start(), m.group(1)) for m in SECTION_HEADER_RE.finditer(source)]
+    if len(starts) == 0:
+        return [SectionChunk(source, 1, "")]
+    chunks = []
+    line = 1
+    for i, (start, name) in enumerate(starts):
+        begin = 0 if i == 0 else start
+        end = starts[i + 1][0] if i + 1 < len(starts) else len(source)
+        text = source[begin:end]
+        chunks.append(SectionChunk(text, line, name))
+        line += text.count("\n")
+    return chunks
+
+
+def shift_section_lines(section: Section, delta: int):
+    """Moves all source locations of a section by delta lines."""
+    locs = [section.loc]
+    for node in section.nodes:
+        locs.append(node.meta.loc)
+        if isinstance(node, SayNode):
+            locs.append(node.line.loc)
+        elif isinstance(node, ChoiceNode):
+            for opt in node.options:
+                locs.append(opt.line.loc)
+                if opt.cond:
+                    locs.append(opt.cond.loc)
+        elif isinstance(node, IfNode):
+            locs.append(node.cond.loc)
+        elif isinstance(node, RunNode):
+            locs.append(node.code.loc)
+    for loc in locs:
+        if loc is not NO_LOC:
+            loc.line += delta
+
+
+def parse_section_chunk(
+    ctx: ErrorContext, source_path: str, chunk: SectionChunk, positions: bool = True
+) -> list[Section] | None:
+    """Parses a chunk returned by split_sections. Node ids are not generated."""
+    try:
+        sections = parse_with_source(chunk.text, "start", positions)
+    except exceptions.UnexpectedInput as exc:
+        add_parse_error(ctx, source_path, exc, chunk.first_line - 1)
+        return None
+    if positions and chunk.first_line != 1:
+        for section in sections:
+            shift_section_lines(section, chunk.first_line - 1)
+    return sections
+
+
+def iter_section_chunks(lines: Iterable[str]) -> Iterator[SectionChunk]:
+    """Like split_sections, but takes the source line by line (e.g. an open file) and
+    yields every chunk as soon as it is complete.
+    """
+    name = None
+    text = []
+    first_line = 1
+    for line_no, line in enumerate(lines, 1):
+        m = SECTION_HEADER_RE.match(line)
+        if m is not None:
+            if name is not None:
+                yield SectionChunk("".join(text), first_line, name)
+                text = []
+                first_line = line_no
+            name = m.group(1)
+        text.append(line)
+    yield SectionChunk("".join(text), first_line, name or "")
+
+
+def iter_dgml_sections(
+    ctx: ErrorContext, source_path: str, positions: bool = True
+) -> Iterator[Section]:
+    """Parses a DGML file one section at a time and yields every section (with node
+    ids) as soon as it is parsed, so that only one section of the file has to be in
+    memory at a time. The result is the same as for parse_dgml.
+
+    A section with a syntax error is reported to ctx and skipped, the remaining
+    sections are still parsed.
+    """
+    # Node signatures contain the section name, so the counts are only shared by
+    # sections of the same name
+    node_sig_counts: dict[str, dict[str, int]] = {}
+    with open(source_path) as f:
+        for chunk in iter_section_chunks(f):
+            sections = parse_section_chunk(ctx, source_path, chunk, positions)
+            if sections is None:
+                continue
+            for section in sections:
+                generate_node_ids(
+                    [section], node_sig_counts.setdefault(section.name, {})
+                )
+                yield section
+
+
+class IncrementalParser:
+    """Parses one DGML file and keeps the result, so that it can be parsed again
+    cheaply after it has been edited.
+
+    The file is split at the section headers and only sections whose text changed are
+    parsed again. The sections of unchanged text are reused (and their source
+    locations moved, if lines were inserted or removed before them).
+    """
+
+    def __init__(self, source_path: str):
+        self.source_path = source_path
+        # chunk text -> (first line, sections) for every chunk of the last parse whose
+        # node ids were generated on their own, i.e. whose section name was unique.
+        # The ids of the other chunks depend on the chunks before them.
+        self.chunks: dict[str, list[tuple[int, list[Section]]]] = {}
+
+    def parse(self, ctx: ErrorContext, source: str) -> list[Section] | None:
+        chunks = split_sections(source)
+
+        # Generated node ids are counted per section name (see generate_node_ids).
+        # Sections that share a name with another section are always parsed again,
+        # so their ids are counted in order, just like in parse_dgml.
+        name_counts = {}
+        for chunk in chunks:
+            name_counts[chunk.name] = name_counts.get(chunk.name, 0) + 1
+
+        dgml = []
+        new_chunks = {}
+        node_sig_counts = {}
+        failed = False
+        for chunk in chunks:
+            reused = None
+            if name_counts[chunk.name] == 1 and self.chunks.get(chunk.text):
+                reused = self.chunks[chunk.text].pop()
+            if reused is not None:
+                first_line, sections = reused
+                if first_line != chunk.first_line:
+                    for section in sections:
+                        shift_section_lines(section, chunk.first_line - first_line)
+            else:
+                sections = parse_section_chunk(ctx, self.source_path, chunk)
+                if sections is None:
+                    failed = True
+                    continue
+                if name_counts[chunk.name] == 1:
+                    generate_node_ids(sections)
+                else:
+                    generate_node_ids(sections, node_sig_counts)
+            if name_counts[chunk.name] == 1:
+                new_chunks.setdefault(chunk.text, []).append(
+                    (chunk.first_line, sections)
+                )
+            dgml.extend(sections)
+
+        self.chunks = new_chunks
+        return None if failed else dgml
+
+
 def print_errors(ctx):
     for msg in ctx.messages:
         if msg.type == "warning":
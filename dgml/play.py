@@ -66,7 +66,10 @@ def main(args):
                     num = i + 1
                 else:
                     num = f"{FAINT}X"
-                dest = section["nodes"][state.node.node_id]["options"][i]["dest"]
+                node = section["nodes"][
+                    dgtree.find_node(args.section, state.node.node_id)
+                ]
+                dest = dgtree.get_node_id(args.section, node["options"][i]["dest"])
                 print(
                     f"{num}. {render_text(option.text)} -> {FAINT}{UNDERLINE}@{dest}{COLOR_RESET}"
                 )
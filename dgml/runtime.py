@@ -1,4 +1,5 @@
 import json
+import operator
 from dataclasses import dataclass
 
 
@@ -35,11 +36,56 @@ class AdvanceResult:
     changed_vars: list[str]
 
 
+# Version of the indexed format (see compile.IndexedEncoder) that can be loaded
+INDEXED_FORMAT_VERSION = 1
+
+
 class DialogueTree:
+    """A compiled dialogue tree, in the default or in the indexed format.
+
+    In the indexed format, strings are indices into `strings`, the tags of text
+    fragments are indices into `tag_sets` and nodes are referenced by their index in
+    the nodes of their section (-1 is the end).
+    """
+
     def __init__(self, path: str):
         with open(path) as f:
             self.data = json.load(f)
 
+        self.indexed = "format" in self.data
+        if self.indexed:
+            if self.data["format"] != "indexed":
+                raise ValueError(f"Unknown format: {self.data['format']}")
+            if self.data["format_version"] != INDEXED_FORMAT_VERSION:
+                raise ValueError(
+                    f"Unsupported format version: {self.data['format_version']}"
+                )
+            self.strings: list[str] = self.data["strings"]
+            self.tag_sets: list[dict] = self.data["tag_sets"]
+        # section name -> node id -> node index, built when needed
+        self._node_idx: dict[str, dict[str, int]] = {}
+
+    def find_node(self, section_name: str, node_id: str):
+        """Returns the key of the node with node_id in the nodes of the section (the
+        node id itself or, in the indexed format, the node index) or None.
+        """
+        section = self.data["sections"][section_name]
+        if not self.indexed:
+            return node_id if node_id in section["nodes"] else None
+        if section_name not in self._node_idx:
+            self._node_idx[section_name] = {
+                self.strings[s]: i for i, s in enumerate(section["node_ids"])
+            }
+        return self._node_idx[section_name].get(node_id)
+
+    def get_node_id(self, section_name: str, node):
+        """Returns the node id of a node key returned by find_node."""
+        if not self.indexed:
+            return node
+        if node == -1:
+            return "end"
+        return self.strings[self.data["sections"][section_name]["node_ids"][node]]
+
 
 def eval_expr(env, expr):
     # dgml lint/compile checked the types of these expressions, so
@@ -86,6 +132,79 @@ def eval_expr(env, expr):
         raise ValueError("Invalid expr")
 
 
+# Bytecode ops, the same as in the binary format (see dgmlb_writer)
+OP_PUSH_BOOL = 1
+OP_PUSH_INT = 2
+OP_PUSH_FLOAT = 3
+OP_PUSH_STRING = 4
+OP_GET_VAR = 5
+OP_SET_VAR = 6
+OP_NOT = 7
+OP_ADD = 8
+OP_SUB = 9
+OP_MUL = 10
+OP_DIV = 11
+OP_LT = 14
+OP_LE = 15
+OP_GT = 16
+OP_GE = 17
+OP_EQ = 18
+OP_NE = 19
+# In the JSON bytecode, or and and (12 and 13) are lowered to these jumps, so the
+# rhs is only evaluated if needed
+OP_JUMP_IF_FALSE = 20
+OP_JUMP_IF_TRUE = 21
+
+BYTECODE_BINARY_OPS = {
+    OP_ADD: operator.add,
+    OP_SUB: operator.sub,
+    OP_MUL: operator.mul,
+    OP_DIV: operator.truediv,
+    OP_LT: operator.lt,
+    OP_LE: operator.le,
+    OP_GT: operator.gt,
+    OP_GE: operator.ge,
+    OP_EQ: operator.eq,
+    OP_NE: operator.ne,
+}
+
+
+def eval_bytecode(env, code: list):
+    """Evaluates the bytecode of an expression (compiled with dgml compile
+    --bytecode), a flat list of ops and their operands, and returns the value left on
+    the stack. Assignments store the value in env instead.
+    """
+    stack = []
+    i = 0
+    end = len(code)
+    while i < end:
+        op = code[i]
+        if OP_PUSH_BOOL <= op <= OP_PUSH_STRING:
+            stack.append(code[i + 1])
+        elif op == OP_GET_VAR:
+            name = code[i + 1]
+            if name not in env:
+                raise KeyError(f"Invalid variable: '{name}'")
+            stack.append(env[name])
+        elif op == OP_NOT:
+            stack[-1] = not stack[-1]
+        elif op == OP_SET_VAR:
+            env[code[i + 1]] = stack.pop()
+        elif op in BYTECODE_BINARY_OPS:
+            rhs = stack.pop()
+            stack[-1] = BYTECODE_BINARY_OPS[op](stack[-1], rhs)
+        elif op == OP_JUMP_IF_FALSE or op == OP_JUMP_IF_TRUE:
+            # or/and: the value of the lhs is the result, if it decides it
+            if bool(stack[-1]) == (op == OP_JUMP_IF_TRUE):
+                i += 2 * code[i + 1]
+            else:
+                stack.pop()
+        else:
+            raise ValueError(f"Invalid op: {op}")
+        i += 2
+    return stack[-1] if stack else None
+
+
 def interpolate_text(env, text) -> list[TextFragment]:
     ret = []
     for frag in text:
@@ -98,6 +217,22 @@ def interpolate_text(env, text) -> list[TextFragment]:
     return ret
 
 
+def interpolate_indexed_text(dgtree: DialogueTree, env, text) -> list[TextFragment]:
+    ret = []
+    for frag in text:
+        tags = dgtree.tag_sets[frag[0]]
+        string = dgtree.strings[frag[1]]
+        # [tag set, string] for text, [tag set, variable name, 1] for variables (see
+        # compile.IndexedEncoder)
+        if len(frag) > 2:
+            if string not in env:
+                raise KeyError(f"Invalid variable: '{string}'")
+            ret.append(TextFragment(tags, env[string]))
+        else:
+            ret.append(TextFragment(tags, string))
+    return ret
+
+
 class Vm:
     def __init__(self, dgtree: DialogueTree):
         self.dgtree = dgtree
@@ -111,17 +246,48 @@ class Vm:
         self.trace = []
         self._current_node = None
         self._nodes = None
+        self._node_ids = None
+        self._end = "end"
+        self._count_steps = True
 
     def enter(self, section_name: str, node_id=None):
         self.trace = []
 
         section = self.dgtree.data["sections"][section_name]
 
-        self._current_node = node_id if node_id is not None else section["start_node"]
-        if self._current_node not in section["nodes"]:
+        if node_id is not None:
+            self._current_node = self.dgtree.find_node(section_name, node_id)
+        else:
+            self._current_node = section["start_node"]
+        if self._current_node is None:
             raise KeyError(f"Invalid node_id '{node_id}' for section '{section_name}'")
 
         self._nodes = section["nodes"]
+        if self.dgtree.indexed:
+            self._node_ids = section["node_ids"]
+            self._end = -1
+        # Compile proved that advance can't loop forever in this section
+        self._count_steps = not section.get("internal_loop_free", False)
+
+    # Accessors for the strings of both formats (see DialogueTree)
+
+    def _get_string(self, value) -> str:
+        return self.dgtree.strings[value] if self.dgtree.indexed else value
+
+    def _get_node_id(self, node) -> str:
+        if self.dgtree.indexed:
+            return self.dgtree.strings[self._node_ids[node]]
+        return node
+
+    def _get_tags(self, node) -> list[str]:
+        if self.dgtree.indexed:
+            return [self.dgtree.strings[tag] for tag in node["tags"]]
+        return node["tags"]
+
+    def _interpolate_text(self, text) -> list[TextFragment]:
+        if self.dgtree.indexed:
+            return interpolate_indexed_text(self.dgtree, self.env, text)
+        return interpolate_text(self.env, text)
 
     def advance(self, option_index: int = None) -> AdvanceResult:
         changed_vars = []
@@ -133,8 +299,8 @@ class Vm:
             self._current_node = node["options"][option_index]["dest"]
 
         num_its = 0
-        while self._current_node != "end":
-            self.trace.append(self._current_node)
+        while self._current_node != self._end:
+            self.trace.append(self._get_node_id(self._current_node))
             node = self._nodes[self._current_node]
             node_type = node["type"]
 
@@ -142,10 +308,10 @@ class Vm:
             if node_type == "say":
                 res = AdvanceResult(
                     SayNode(
-                        self._current_node,
-                        node["tags"],
-                        node["speaker_id"],
-                        interpolate_text(self.env, node["line"]["text"]),
+                        self._get_node_id(self._current_node),
+                        self._get_tags(node),
+                        self._get_string(node["speaker_id"]),
+                        self._interpolate_text(node["line"]["text"]),
                     ),
                     changed_vars,
                 )
@@ -157,31 +323,43 @@ class Vm:
                 options = []
                 for option in node["options"]:
                     enabled = True
-                    if "cond" in option:
+                    if "bytecode" in option:
+                        enabled = eval_bytecode(self.env, option["bytecode"])
+                    elif "cond" in option:
                         enabled = eval_expr(self.env, option["cond"])
                     options.append(
                         ChoiceOption(
-                            interpolate_text(self.env, option["line"]["text"]), enabled
+                            self._interpolate_text(option["line"]["text"]), enabled
                         )
                     )
 
                 return AdvanceResult(
-                    ChoiceNode(self._current_node, node["tags"], options), changed_vars
+                    ChoiceNode(
+                        self._get_node_id(self._current_node),
+                        self._get_tags(node),
+                        options,
+                    ),
+                    changed_vars,
                 )
 
             # Internal nodes
             elif node_type == "if":
-                cond = eval_expr(self.env, node["cond"])
+                if "bytecode" in node:
+                    cond = eval_bytecode(self.env, node["bytecode"])
+                else:
+                    cond = eval_expr(self.env, node["cond"])
                 if cond:
                     self._current_node = node["true_dest"]
                 else:
                     self._current_node = node["false_dest"]
             elif node_type == "run":
                 expr = node["code"]
-                if expr["type"] == "assign":
-                    self.env[expr["name"]] = eval_expr(self.env, expr["value"])
-                else:
+                if expr["type"] != "assign":
                     raise ValueError("Invalid run")
+                if "bytecode" in node:
+                    eval_bytecode(self.env, node["bytecode"])
+                else:
+                    self.env[expr["name"]] = eval_expr(self.env, expr["value"])
 
                 if expr["name"] not in changed_vars:
                     changed_vars.append(expr["name"])
@@ -192,8 +370,9 @@ class Vm:
             else:
                 raise ValueError(f"Unknown node type: {node['type']}")
 
-            num_its += 1
-            if num_its > 100:
-                raise StopIteration("Too many iterations")
+            if self._count_steps:
+                num_its += 1
+                if num_its > 100:
+                    raise StopIteration("Too many iterations")
 
         return AdvanceResult(None, changed_vars)
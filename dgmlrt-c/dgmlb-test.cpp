@@ -149,7 +149,7 @@ int main(int, char**)
     auto file = fopen("../examples/quest/quest.dgmlb", "rb");
     char magic[8] = {};
     fread(magic, 1, 8, file);
-    if (memcmp(magic, "\0DGMLB01", 8)) {
+    if (memcmp(magic, "\0DGMLB02", 8)) {
         fprintf(stderr, "wrong magic");
         return 1;
     }
@@ -199,7 +199,8 @@ int main(int, char**)
 
     printf("sections:\n");
     for (const auto& section : dgmlb.span<dgmlb_section>(header.sections)) {
-        printf("%s\n", dgmlb.str(section.name));
+        printf("%s%s\n", dgmlb.str(section.name),
+            section.flags & DGMLB_SECTION_FLAG_INTERNAL_LOOP_FREE ? " (loop free)" : "");
         for (const auto& node : dgmlb.span<dgmlb_node>(section.nodes)) {
             printf("node (%d) '%s'\n", node.type, dgmlb.str(node.id));
             if (node.tags.count) {
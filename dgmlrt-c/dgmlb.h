@@ -27,7 +27,7 @@ typedef struct {
 } dgmlb_string;
 
 typedef struct {
-    char magic[8]; // 0x00 D G M L B 0 1
+    char magic[8]; // 0x00 D G M L B 0 2
     uint32_t file_size;
     dgmlb_span strings; // packed dgmlb_strings. mind unaligned access to `length`!
     dgmlb_span sections; // dgmlb_section
@@ -52,12 +52,19 @@ typedef struct {
 } dgmlb_env_var;
 //_Static_assert(sizeof(dgmlb_env_var) == 3 * 4);
 
+typedef uint32_t dgmlb_section_flags;
+enum {
+    // No loop of internal nodes (GOTO, IF, RUN, RAND), so advance always terminates
+    DGMLB_SECTION_FLAG_INTERNAL_LOOP_FREE = 1,
+};
+
 typedef struct {
     dgmlb_stroff name;
     dgmlb_span nodes; // dgmlb_node
     uint32_t entry_node; // index into nodes
+    dgmlb_section_flags flags;
 } dgmlb_section;
-//_Static_assert(sizeof(dgmlb_section) == 4 * 4);
+//_Static_assert(sizeof(dgmlb_section) == 5 * 4);
 
 typedef uint32_t dgmlb_node_type;
 enum {
@@ -178,6 +178,7 @@ struct Section {
     dgmlrt_string name = {};
     Array<Node> nodes = {};
     uint32_t entry_node = UINT32_MAX;
+    bool internal_loop_free = false;
 };
 
 struct Tree {
@@ -341,7 +342,7 @@ EXPORT dgmlrt_tree* dgmlrt_load_dgmlb(const uint8_t* data, size_t size, dgmlrt_a
         return nullptr;
     }
 
-    if (memcmp(header.magic, "\0DGMLB01", 8)) {
+    if (memcmp(header.magic, "\0DGMLB02", 8)) {
         fprintf(stderr, "Wrong magic\n");
         return nullptr;
     }
@@ -381,6 +382,8 @@ EXPORT dgmlrt_tree* dgmlrt_load_dgmlb(const uint8_t* data, size_t size, dgmlrt_a
     for (size_t s = 0; s < header.sections.count; ++s) {
         tree->sections[s].name = string(tree, sections[s].name);
         tree->sections[s].entry_node = sections[s].entry_node;
+        tree->sections[s].internal_loop_free
+            = sections[s].flags & DGMLB_SECTION_FLAG_INTERNAL_LOOP_FREE;
         tree->sections[s].nodes.allocate(alloc, sections[s].nodes.count);
         auto nodes = file.span<dgmlb_node>(sections[s].nodes);
         for (size_t n = 0; n < tree->sections[s].nodes.size; ++n) {
@@ -513,7 +516,13 @@ EXPORT dgmlrt_vm* dgmlrt_vm_create(
 
     size_t max_num_options = 0;
     size_t max_text_frags = 0;
+    // Advance is not limited in sections without loops, but it can't visit more nodes than
+    // there are in the section
+    size_t max_trace_size = vm->max_steps_per_advance;
     for (size_t s = 0; s < vm->tree->sections.size; ++s) {
+        if (vm->tree->sections[s].internal_loop_free) {
+            max_trace_size = max(max_trace_size, vm->tree->sections[s].nodes.size);
+        }
         for (size_t n = 0; n < vm->tree->sections[s].nodes.size; ++n) {
             const auto& node = vm->tree->sections[s].nodes[n];
             if (node.type == Node::Type::Say) {
@@ -529,7 +538,7 @@ EXPORT dgmlrt_vm* dgmlrt_vm_create(
         }
     }
     vm->options_buf.allocate(alloc, max_num_options);
-    vm->trace_buf.allocate(alloc, vm->max_steps_per_advance);
+    vm->trace_buf.allocate(alloc, max_trace_size);
     vm->text_frags_buf.allocate(alloc, max_text_frags);
 
     if (params.rng_func) {
@@ -1092,7 +1101,8 @@ EXPORT dgmlrt_advance_result dgmlrt_vm_advance(dgmlrt_vm* ovm, int option_index)
             abort(); // should be unreachable, because we checked type during load
         }
 
-        if (res.num_visited_node_ids >= vm->max_steps_per_advance) {
+        if (!vm->current_section->internal_loop_free
+            && res.num_visited_node_ids >= vm->max_steps_per_advance) {
             return error({ DGMLRT_ERROR_MAX_ITERATIONS, "Exceeded max iterations" });
         }
     }
@@ -0,0 +1,86 @@
+import sys
+
+import pytest
+
+from dgml.cli import main
+from dgml.compile import expr_to_bytecode, is_internal_loop_free
+from dgml.runtime import eval_bytecode, eval_expr
+
+
+def test_internal_loop_free_uses_compiled_nodes():
+    # What compile makes of "@x RUN |n = n + 1| @x alice: ...": the second node
+    # with the duplicate id is dropped, so the RUN node continues at itself
+    nodes = {"x": {"tags": [], "type": "run", "code": {}, "next": "x"}}
+    assert not is_internal_loop_free(nodes)
+
+
+def test_internal_loop_free_ignores_loops_through_say():
+    nodes = {
+        "a": {"tags": [], "type": "goto", "dest": "b"},
+        "b": {"tags": [], "type": "say", "next": "a"},
+        "c": {"tags": [], "type": "if", "true_dest": "a", "false_dest": "end"},
+    }
+    assert is_internal_loop_free(nodes)
+    nodes["b"] = {"tags": [], "type": "rand", "nodes": ["c"]}
+    assert not is_internal_loop_free(nodes)
+
+
+def test_lint_errors_fail_the_build(monkeypatch, tmp_path, capsys):
+    path = tmp_path / "test.dgml"
+    path.write_text('[a]\nalice: "Hi [b]x[/c]"\n\n[a]\nalice: "hi"\n')
+    output = tmp_path / "test.json"
+    argv = ["dgml", "compile", "-o", str(output), str(path)]
+    monkeypatch.setattr(sys, "argv", argv)
+    with pytest.raises(SystemExit) as exc:
+        main()
+    assert exc.value.code == 1
+    assert not output.exists()
+    err = capsys.readouterr().err
+    assert "Invalid nesting of markup tags: c" in err
+    assert "Duplicate section name: a" in err
+
+
+def test_invalid_node_ids_fail_the_build(monkeypatch, tmp_path, capsys):
+    path = tmp_path / "test.dgml"
+    path.write_text("[g]\nGOTO @nope\n")
+    for args in [[], ["--indexed"], ["-b"]]:
+        output = tmp_path / "test.out"
+        argv = ["dgml", "compile", *args, "-o", str(output), str(path)]
+        monkeypatch.setattr(sys, "argv", argv)
+        with pytest.raises(SystemExit) as exc:
+            main()
+        assert exc.value.code == 1
+        assert not output.exists()
+        assert "Invalid node id: nope" in capsys.readouterr().err
+
+
+def test_bytecode_short_circuits():
+    # |x != 0 and 10 / x > 1|
+    expr = {
+        "type": "binary_and",
+        "lhs": {
+            "type": "binary_ne",
+            "lhs": {"type": "variable", "name": "x"},
+            "rhs": {"type": "literal_int", "value": 0},
+        },
+        "rhs": {
+            "type": "binary_gt",
+            "lhs": {
+                "type": "binary_div",
+                "lhs": {"type": "literal_int", "value": 10},
+                "rhs": {"type": "variable", "name": "x"},
+            },
+            "rhs": {"type": "literal_int", "value": 1},
+        },
+    }
+    code = expr_to_bytecode(expr)
+    for x in [0, 5, 20]:
+        assert eval_bytecode({"x": x}, code) == eval_expr({"x": x}, expr)
+
+    # |has_key or missing_var|
+    expr = {
+        "type": "binary_or",
+        "lhs": {"type": "variable", "name": "has_key"},
+        "rhs": {"type": "variable", "name": "missing_var"},
+    }
+    assert eval_bytecode({"has_key": True}, expr_to_bytecode(expr)) is True
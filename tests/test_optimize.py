@@ -0,0 +1,49 @@
+import json
+import sys
+
+from dgml.cli import main
+from dgml.runtime import DialogueTree, Vm
+
+
+def compile_dgml(monkeypatch, tmp_path, source, *args):
+    path = tmp_path / "test.dgml"
+    path.write_text(source)
+    output = tmp_path / "test.out"
+    argv = ["dgml", "compile", *args, "-o", str(output), str(path)]
+    monkeypatch.setattr(sys, "argv", argv)
+    main()
+    return output
+
+
+def test_section_that_ends_right_away(monkeypatch, tmp_path):
+    source = "[s]\nGOTO @end\n"
+
+    output = compile_dgml(monkeypatch, tmp_path, source, "-O", "-b")
+    assert output.read_bytes().startswith(b"\x00DGMLB")
+
+    output = compile_dgml(monkeypatch, tmp_path, source, "-O")
+    section = json.loads(output.read_text())["sections"]["s"]
+    assert section["start_node"] in section["nodes"]
+
+    vm = Vm(DialogueTree(str(output)))
+    vm.enter("s")
+    assert vm.advance().node is None
+
+
+def test_goto_chains_and_constant_ifs(monkeypatch, tmp_path):
+    source = (
+        "[s]\n"
+        "IF |1 + 1 == 2| @a\n"
+        'alien: "never"\n'
+        "@a\n"
+        "GOTO @b\n"
+        "@b\n"
+        'alien: "hi"\n'
+    )
+    output = compile_dgml(monkeypatch, tmp_path, source, "-O")
+    section = json.loads(output.read_text())["sections"]["s"]
+    # The constant IF and the GOTO are skipped
+    assert section["start_node"] == "b"
+    # Explicit node ids are kept, generated ones of unreachable nodes are not
+    assert list(section["nodes"]) == ["a", "b"]
+    assert section["nodes"]["a"]["dest"] == "b"
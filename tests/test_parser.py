@@ -0,0 +1,18 @@
+from dgml.parser import ErrorContext, IncrementalParser, parse_dgml
+
+
+def node_ids(sections):
+    return [[node.meta.node_id for node in section.nodes] for section in sections]
+
+
+def test_incremental_parse_when_a_duplicate_section_name_becomes_unique():
+    versions = [
+        '[a]\nalice: "hi"\n; one\n[a]\nalice: "hi"\n; two\n',
+        '[a]\nalice: "hi"\n; two\n',
+        '[a]\nalice: "hi"\n; one\n[a]\nalice: "hi"\n; two\n',
+    ]
+    parser = IncrementalParser("test.dgml")
+    for source in versions:
+        sections = parser.parse(ErrorContext([]), source)
+        expected = parse_dgml(ErrorContext([]), "test.dgml", source)
+        assert node_ids(sections) == node_ids(expected)